@@ -0,0 +1,309 @@
+"""
+Benchmark harness for label generation and PL building.
+
+Generates synthetic D2C, FNSKU and PL inputs, runs generate_labels (ZIP,
+multi-page PDF or ZPL output) and build_pl_base headlessly (no Streamlit)
+and writes the results as JSON so runs can be compared between commits.
+"startup" cases time the app itself (Streamlit's AppTest, no server): a cold
+first run on each page, a warm rerun and a first switch to the other page.
+Every case runs in a fresh process so peak RSS, imports and the in-memory
+caches are per case. Runs fully offline.
+
+    python benchmarks/bench_labels.py
+    python benchmarks/bench_labels.py --sizes 10 1000 --barcodes raster vector
+    python benchmarks/bench_labels.py --compare benchmarks/results/<old>.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from multiprocessing import get_context
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+APP_PATH = os.path.join(REPO_ROOT, "d2clabelsv4app.py")
+APP_PAGES = {"labels": "Labels Generator", "pl": "PL Builder"}
+# Page-specific heavy imports; startup cases report which ones got loaded
+HEAVY_MODULES = ["reportlab", "barcode", "PyPDF2", "pdfplumber", "xlsxwriter", "labels_core", "pl_builder"]
+
+DEFAULT_SIZES = [10, 1000, 10000, 50000]
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+PRODUCT_WORDS = [
+    "Seamless", "Shaping", "Bodysuit", "Thong", "Bra", "Brief", "Sculpting",
+    "Comfort", "Black", "Nude", "Small", "Medium", "Large", "Pack", "Cotton",
+]
+LOCATIONS = ["JD NJ : JD NJ - AMZ FBA", "JD Canada", "JD CA - Walmart", "Lateral TJ", "Amazon FBA UK"]
+
+
+# --- SYNTHETIC INPUTS ---
+# Deterministic for a given size, so two commits benchmark identical data.
+
+def _ean13(i):
+    body = f"{i:012d}"
+    total = sum(int(d) * (3 if n % 2 else 1) for n, d in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+def synth_d2c(rows):
+    import pandas as pd
+    return pd.DataFrame({
+        'SKU': [f"SKU-{i:06d}" for i in range(rows)],
+        'UPC Code': [_ean13(40000000000 + i)[1:] for i in range(rows)],
+        'LOT#': [f"LOT{i % 97:03d}" if i % 5 else None for i in range(rows)],
+    })
+
+def synth_fnsku(rows):
+    import pandas as pd
+    names = [
+        " ".join(PRODUCT_WORDS[(i + k) % len(PRODUCT_WORDS)] for k in range(3 + i % 6))
+        for i in range(rows)
+    ]
+    return pd.DataFrame({
+        'FNSKU': [f"X00{i:07X}" for i in range(rows)],
+        'Product Name': names,
+        'LOT#': [f"LOT{i % 97:03d}" if i % 3 else None for i in range(rows)],
+    })
+
+def synth_pl(rows):
+    import pandas as pd
+    df = pd.DataFrame({
+        'TO': ["TO12345"] * rows,
+        'FOP SO #': ["SO67890"] * rows,
+        'From Loc': [LOCATIONS[0]] * rows,
+        'To Loc': [LOCATIONS[1]] * rows,
+        'SKU External ID': [f"SKU-{i:06d}" for i in range(rows)],
+        'Required Qty': [(i % 48) + 1 for i in range(rows)],
+        'Shipping Method': ["Ground"] * rows,
+    })
+    total = pd.DataFrame({'TO': ["Total"], 'Total QTY': [int(df['Required Qty'].sum())]})
+    return pd.concat([df, total], ignore_index=True)
+
+SYNTHESIZERS = {"d2c": synth_d2c, "fnsku": synth_fnsku, "pl": synth_pl}
+
+
+# --- CASE RUNNER (executed in a fresh process) ---
+
+def _to_xlsx(df):
+    output = BytesIO()
+    df.to_excel(output, index=False, engine='xlsxwriter')
+    return output.getvalue()
+
+def _peak_rss_bytes():
+    # ru_maxrss is KiB on Linux; children covers label render pool workers
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, children_rss) * 1024
+
+def run_startup_case(case):
+    stages = {}
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    stages["import_streamlit"] = time.perf_counter() - started
+
+    page, other_page = APP_PAGES[case["page"]], next(p for p in APP_PAGES.values() if p != APP_PAGES[case["page"]])
+    app = AppTest.from_file(APP_PATH, default_timeout=120)
+    app.session_state["nav_module"] = page
+    started = time.perf_counter()
+    app.run()
+    stages["first_run"] = time.perf_counter() - started
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    started = time.perf_counter()
+    app.run()
+    stages["rerun"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app.sidebar.radio(key="nav_module").set_value(other_page).run()
+    stages["page_switch"] = time.perf_counter() - started
+    return {
+        **case, "stages": stages, "total_sec": sum(stages.values()), "heavy_modules_loaded": loaded,
+        "errors": [element.value for element in app.exception], "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+def run_case(case):
+    if case["module"] == "startup":
+        return run_startup_case(case)
+    import labels_core
+    import pl_builder
+    from ingest import read_table
+    from instrumentation import Instrumentation, recording
+
+    module, rows = case["module"], case["rows"]
+    stages = {}
+    df = SYNTHESIZERS[module](rows)
+    input_format = case.get("input", "xlsx")
+    input_bytes = _to_xlsx(df) if input_format == "xlsx" else df.to_csv(index=False).encode("utf-8")
+    input_name = f"input.{input_format}"
+
+    # Same ingestion path as the app: pruned columns, identifiers as text
+    started = time.perf_counter()
+    if module == "pl":
+        df = pl_builder.read_pl_upload(input_name, input_bytes)
+    else:
+        columns, text_columns = labels_core.label_upload_columns(module)
+        df = read_table(input_name, input_bytes, columns=columns, text_columns=text_columns)
+    stages["parse_excel"] = time.perf_counter() - started
+
+    result = {**case, "input_bytes": len(input_bytes)}
+    if module == "pl":
+        started = time.perf_counter()
+        with recording(Instrumentation()) as run:
+            output, _ = pl_builder.build_pl_base(df)
+        stages["build_pl"] = time.perf_counter() - started
+        result["stats"] = run.to_stats()
+        result["output_bytes"] = len(output.getvalue())
+        result["rows_per_sec"] = rows / stages["build_pl"]
+    else:
+        prepare = labels_core.prepare_d2c_rows if module == "d2c" else labels_core.prepare_fnsku_rows
+        started = time.perf_counter()
+        prepare(df)
+        stages["prepare_rows"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            output, _, row_errors, stats = labels_core.generate_labels(
+                module,
+                df,
+                case["output"],
+                vector_barcodes=case["barcodes"] == "vector",
+                workers=case["workers"],
+                use_cache=False,
+            )
+            total = time.perf_counter() - started
+        finally:
+            # This process is a pool child itself; live render workers would hang its exit
+            labels_core.shutdown_pool()
+        output_bytes = output.seek(0, os.SEEK_END) if output else 0
+        # generate() validates again internally; the remainder is render + write
+        stages["render_and_write"] = max(total - stages["prepare_rows"], 0.0)
+        result["output_bytes"] = output_bytes
+        result["row_errors"] = len(row_errors)
+        result["labels_per_sec"] = rows / total
+        # stage timings from the generator's own instrumentation
+        result["stats"] = stats
+    result["stages"] = stages
+    result["total_sec"] = sum(stages.values())
+    result["peak_rss_bytes"] = _peak_rss_bytes()
+    return result
+
+
+# --- DRIVER ---
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _environment():
+    import barcode
+    import pandas as pd
+    import reportlab
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pandas": pd.__version__,
+        "reportlab": reportlab.Version,
+        "python_barcode": barcode.version,
+    }
+
+def build_cases(args):
+    cases = []
+    if "startup" in args.modules:
+        cases += [{"module": "startup", "page": page} for page in APP_PAGES]
+    for rows in args.sizes:
+        for input_format in args.inputs:
+            if "pl" in args.modules:
+                cases.append({"module": "pl", "rows": rows, "input": input_format})
+            for module in ("d2c", "fnsku"):
+                if module not in args.modules:
+                    continue
+                for barcodes in args.barcodes:
+                    for output in args.outputs:
+                        cases.append({
+                            "module": module, "rows": rows, "barcodes": barcodes,
+                            "output": output, "workers": args.workers, "input": input_format,
+                        })
+    return cases
+
+def case_id(case):
+    if case["module"] == "startup":
+        return f"startup/{case['page']}"
+    parts = [case["module"], str(case["rows"])]
+    if case["module"] != "pl":
+        parts += [case["barcodes"], case["output"], f"w{case['workers']}"]
+    if case.get("input", "xlsx") != "xlsx":
+        parts.append(case["input"])
+    return "/".join(parts)
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case_id(r): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get(case_id(result))
+        if not old:
+            continue
+        change = (result["total_sec"] - old["total_sec"]) / old["total_sec"] if old["total_sec"] else 0
+        print(f"  {case_id(result):<34} {old['total_sec']:8.3f}s -> {result['total_sec']:8.3f}s ({change:+.0%})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--modules", nargs="+", choices=["startup", "d2c", "fnsku", "pl"], default=["startup", "d2c", "fnsku", "pl"]
+    )
+    parser.add_argument("--barcodes", nargs="+", choices=["raster", "vector"], default=["vector"])
+    parser.add_argument("--outputs", nargs="+", choices=["zip", "pdf", "zpl"], default=["zip", "pdf"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--inputs", nargs="+", choices=["xlsx", "csv"], default=["xlsx"])
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>-<timestamp>.json)")
+    parser.add_argument("--compare", help="previous results file to diff against")
+    args = parser.parse_args(argv)
+
+    commit = _git_commit()
+    started_at = datetime.now(timezone.utc)
+    results = []
+    for case in build_cases(args):
+        # A fresh process per case keeps peak RSS and warm caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_case, case).result()
+        results.append(result)
+        if case["module"] == "startup":
+            stages = "  ".join(f"{name} {seconds:.3f}s" for name, seconds in result["stages"].items())
+            print(f"{case_id(case):<34} {stages}  loaded: {', '.join(result['heavy_modules_loaded']) or '-'}")
+            continue
+        rate = result.get("labels_per_sec", result.get("rows_per_sec"))
+        print(
+            f"{case_id(case):<34} {result['total_sec']:8.3f}s  {rate:10.1f}/s  "
+            f"{result['output_bytes'] / 1024:10.1f} KiB  {result['peak_rss_bytes'] / 1024 ** 2:7.1f} MiB RSS"
+        )
+
+    output_path = args.output or os.path.join(
+        RESULTS_DIR, f"{commit}-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({
+            "commit": commit,
+            "started_at": started_at.isoformat(),
+            "environment": _environment(),
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {output_path}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
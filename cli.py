@@ -0,0 +1,189 @@
+"""
+Headless entry point for the TOs Hub label generators and PL Builder, for
+scheduled runs (cron, CI) that shouldn't need a browser.
+
+    python cli.py d2c labels.xlsx -o labels.zip
+    python cli.py fnsku fnsku.csv -o labels.pdf --workers 8
+    python cli.py d2c labels.xlsx -o labels.zpl
+    python cli.py d2c labels.xlsx -o labels/ --format dir --errors errors.csv
+    python cli.py pl export1.xlsx export2.xlsx -o packing_lists.zip --split
+
+The output format follows the output path's extension unless --format is
+given. Exit status is 0 when everything was written, 1 when some rows (or PL
+files) were rejected or failed while the rest were still written, and 2 when
+nothing could be produced (unreadable input, missing columns, bad options).
+"""
+import argparse
+import csv
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_ROW_ERRORS = 1
+EXIT_FAILED = 2
+ERRORS_SHOWN = 20
+
+class ProgressPrinter:
+    """Progress callback printing a line to stderr every `step` of the way."""
+
+    def __init__(self, label, step=0.1, enabled=True):
+        self.label = label
+        self.step = step
+        self.enabled = enabled
+        self._next = step
+
+    def __call__(self, fraction):
+        if self.enabled and fraction >= self._next:
+            print(f"{self.label}: {fraction:.0%}", file=sys.stderr, flush=True)
+            while self._next <= fraction:
+                self._next += self.step
+
+class ErrorReport:
+    """Error callback: collects (where, message) rows, echoing the first few to stderr."""
+
+    def __init__(self, header, quiet=False):
+        self.header = header
+        self.quiet = quiet
+        self.rows = []
+
+    def __call__(self, where, message):
+        self.rows.append((where, message))
+        if not self.quiet and len(self.rows) <= ERRORS_SHOWN:
+            print(f"{self.header[0]} {where}: {message}", file=sys.stderr)
+
+    def write(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.header)
+            writer.writerows(self.rows)
+
+    def summary(self):
+        hidden = len(self.rows) - ERRORS_SHOWN
+        more = f" ({hidden} not shown)" if hidden > 0 and not self.quiet else ""
+        return f"{len(self.rows)} error(s){more}"
+
+def _output_format(args, formats):
+    if args.format:
+        return args.format
+    extension = os.path.splitext(args.output)[1].lower().lstrip(".")
+    return extension if extension in formats else "dir"
+
+def _finish(report, args):
+    if args.errors:
+        report.write(args.errors)
+    if report.rows:
+        print(report.summary() + (f", report written to {args.errors}" if args.errors else ""), file=sys.stderr)
+
+def run_labels(args):
+    from ingest import read_table
+    from instrumentation import Instrumentation, log_run
+    from labels_core import OUTPUT_FORMATS, generate_labels, label_upload_columns
+
+    output_format = _output_format(args, OUTPUT_FORMATS)
+    columns, text_columns = label_upload_columns(args.kind)
+    with open(args.input, "rb") as f:
+        df = read_table(os.path.basename(args.input), f.read(), columns=columns, text_columns=text_columns)
+    if args.lookup:
+        from lookups import fill_label_fields, get_lookup_service
+        service = get_lookup_service({"url": os.environ.get("SUPABASE_URL"), "key": os.environ.get("SUPABASE_KEY")})
+        df, filled, unresolved = fill_label_fields(args.kind, df, service)
+        if not args.quiet:
+            print(f"{filled} blank cell(s) filled from the database, {unresolved} not found", file=sys.stderr)
+    report = ErrorReport(["Excel Row", "Error"], quiet=args.quiet)
+    _, written, row_errors, stats = generate_labels(
+        args.kind, df, output_format, destination=args.output,
+        vector_barcodes=args.vector_barcodes, workers=args.workers,
+        progress_callback=ProgressPrinter(f"{args.kind} labels", enabled=not args.quiet),
+        error_callback=report, use_cache=not args.no_cache, layout=args.layout,
+    )
+    run = Instrumentation()
+    run.merge_stats(stats)
+    log_run("label_batch", run, kind=args.kind, rows=len(df), workers=args.workers, output_format=output_format)
+    _finish(report, args)
+    if not written:
+        print("No labels were written.", file=sys.stderr)
+        return EXIT_FAILED
+    if not args.quiet:
+        print(f"{stats.get('labels_rendered', 0)} label(s) written to {written}", file=sys.stderr)
+    return EXIT_ROW_ERRORS if row_errors else EXIT_OK
+
+def run_pl(args):
+    from instrumentation import Instrumentation, log_run, recording
+    from pl_builder import build_pl_files, zip_pl_files
+
+    output_format = _output_format(args, ("zip",))
+    uploads = []
+    for path in args.inputs:
+        with open(path, "rb") as f:
+            uploads.append((os.path.basename(path), f.read()))
+    with recording(Instrumentation()) as run:
+        entries = build_pl_files(
+            uploads, progress_callback=ProgressPrinter("PLs", enabled=not args.quiet), split=args.split
+        )
+    report = ErrorReport(["File", "Error"], quiet=args.quiet)
+    for entry in entries:
+        if "error" in entry:
+            report(entry["name"], entry["error"])
+    built = [entry for entry in entries if "data" in entry]
+    log_run("pl_build", run, files=len(uploads), pls_built=len(built), output_format=output_format)
+    _finish(report, args)
+    if not built:
+        print("No PLs were built.", file=sys.stderr)
+        return EXIT_FAILED
+    if output_format == "zip":
+        with open(args.output, "wb") as f:
+            f.write(zip_pl_files(entries))
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        for entry in built:
+            with open(os.path.join(args.output, entry["filename"]), "wb") as f:
+                f.write(entry["data"])
+    if not args.quiet:
+        print(f"{len(built)} PL(s) written to {args.output}", file=sys.stderr)
+    return EXIT_ROW_ERRORS if report.rows else EXIT_OK
+
+def build_parser():
+    from labels_core import DEFAULT_LAYOUTS, OUTPUT_FORMATS, default_worker_count, layouts_for
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for kind in ("d2c", "fnsku"):
+        labels = commands.add_parser(kind, help=f"generate {kind.upper()} labels from an Excel/CSV file")
+        labels.set_defaults(run=run_labels, kind=kind)
+        labels.add_argument("input", help="Excel (.xlsx/.xls) or CSV file")
+        labels.add_argument("-o", "--output", required=True, help="ZIP/PDF/ZPL file or directory to write")
+        labels.add_argument("--format", choices=OUTPUT_FORMATS, help="default: from the output extension")
+        labels.add_argument("--layout", choices=layouts_for(kind), default=DEFAULT_LAYOUTS[kind])
+        labels.add_argument("--workers", type=int, default=default_worker_count())
+        labels.add_argument("--vector-barcodes", action="store_true", help="draw bars into the PDF instead of PNGs")
+        labels.add_argument("--no-cache", action="store_true", help="bypass the rendered label cache")
+        labels.add_argument(
+            "--lookup", action="store_true",
+            help="fill blank UPC Code / Product Name from the database (SUPABASE_URL/SUPABASE_KEY, else LOOKUP_DB_PATH)"
+        )
+    pl = commands.add_parser("pl", help="build packing lists from Excel/CSV exports")
+    pl.set_defaults(run=run_pl)
+    pl.add_argument("inputs", nargs="+", help="Excel (.xlsx/.xls) or CSV exports")
+    pl.add_argument("-o", "--output", required=True, help="ZIP file or directory to write")
+    pl.add_argument("--format", choices=["zip", "dir"], help="default: from the output extension")
+    pl.add_argument("--split", action="store_true", help="split consolidated exports by TO")
+    for command in (*(commands.choices[kind] for kind in ("d2c", "fnsku")), pl):
+        command.add_argument("--errors", help="write the error report (CSV) to this path")
+        command.add_argument("--timings", action="store_true", help="log per-stage timings as JSON to stderr")
+        command.add_argument("-q", "--quiet", action="store_true", help="only print the error summary")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.timings:
+        from instrumentation import configure_logging
+        configure_logging()
+    try:
+        return args.run(args)
+    except Exception as e:
+        # Exit 1 means "some rows failed", so anything unexpected must not surface as a traceback's 1
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+if __name__ == "__main__":
+    sys.exit(main())
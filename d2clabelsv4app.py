@@ -1,22 +1,26 @@
-# ✅ FIXED VERSION: PL Builder module added, label logic preserved untouched from original version.
-
 # TOs Hub - Streamlit App with Labels Generator + PL Builder
 import streamlit as st
 import pandas as pd
+import hashlib
+import hmac
 import os
-import re
+import uuid
 from io import BytesIO
-from reportlab.lib.pagesizes import mm
-from reportlab.pdfgen import canvas
-from barcode import EAN13, Code128
-from barcode.writer import ImageWriter
-from datetime import datetime
-from zipfile import ZipFile
-from PyPDF2 import PdfReader, PdfWriter
-import pdfplumber
-import textwrap
-import difflib  # 🔁 ADD THIS NEW IMPORT
-import urllib.parse
+# Page-specific heavy dependencies are imported where they are first used:
+# labels_core (reportlab, python-barcode, PyPDF2) only by the Labels
+# Generator, pl_builder (xlsxwriter) only by the PL Builder. Imported modules
+# stay in sys.modules, so reruns and later page switches don't pay again.
+from ingest import read_table
+from lookups import (
+    BULK_UPDATE_COLUMNS,
+    LABEL_LOOKUPS,
+    bulk_update_pairs,
+    fill_label_fields,
+    get_lookup_service,
+    lookups_configured,
+)
+from jobs import CANCELLED, DONE, FAILED, QUEUED, JobRejected, get_job_manager
+from instrumentation import Instrumentation, configure_logging, log_run, profiled, recording, stage
 
 def normalize_column_names(df):
     """
@@ -46,8 +50,11 @@ def normalize_column_names(df):
 
 
 
-# --- ORIGINAL LABEL LOGIC STARTS HERE (UNCHANGED) ---
+# --- LABELS GENERATOR UI ---
+# Templates, validation reports and result panels. Row preparation and
+# rendering live in labels_core.py, which has no Streamlit dependency.
 
+@st.cache_data(show_spinner=False)
 def generate_d2c_template():
     df = pd.DataFrame(columns=['SKU', 'UPC Code', 'LOT#'])
     output = BytesIO()
@@ -56,6 +63,7 @@ def generate_d2c_template():
     output.seek(0)
     return output
 
+@st.cache_data(show_spinner=False)
 def generate_fnsku_template():
     df = pd.DataFrame(columns=['FNSKU', 'Product Name', 'LOT#'])
     output = BytesIO()
@@ -81,295 +89,475 @@ def show_template_download_buttons():
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
-def clean_filename(name):
-    return re.sub(r'[<>:"/\\|?*]', '', name)
-
-def generate_fnsku_barcode(fnsku):
-    fnsku_barcode = Code128(fnsku, writer=ImageWriter())
-    fnsku_barcode.writer.set_options({
-        'module_width': 0.35,
-        'module_height': 16,
-        'font_size': 7.75,
-        'text_distance': 4.5,
-        'quiet_zone': 1.25,
-        'dpi': 600
-    })
-    barcode_filename = f"{fnsku}_barcode"
-    fnsku_barcode.save(barcode_filename)
-    return f"{barcode_filename}.png"
-
-def generate_d2c_barcode(upc_code, sku):
-    barcode_ean = EAN13(upc_code, writer=ImageWriter())
-    clean_sku = clean_filename(sku)
-    barcode_filename = f"{clean_sku}_barcode"
-    barcode_ean.save(barcode_filename)
-    return f"{barcode_filename}.png"
-
-def wrap_text_to_two_lines(text, max_length, c, start_x, start_y, line_height, max_width):
-    text = str(text) if pd.notna(text) else ""
-    if len(text) > 2 * max_length:
-        text_to_display = text[:20] + '...' + text[-20:]
-    else:
-        text_to_display = text
-    lines = textwrap.wrap(text_to_display, width=25)
-    if len(lines) > 2:
-        lines = lines[:2]
-    for i, line in enumerate(lines):
-        c.drawString(start_x, start_y - i * line_height, line)
-
-def create_fnsku_pdf(barcode_image, fnsku, product_name, lot, output_folder):
-    pdf_filename = os.path.join(output_folder, f"{fnsku}_fnsku_label.pdf")
-    c = canvas.Canvas(pdf_filename, pagesize=(60 * mm, 35 * mm))
-    c.drawImage(barcode_image, 4.5 * mm, 10 * mm, width=51.5 * mm, height=16 * mm)
-    font_size = 9
-    c.setFont("Helvetica", font_size)
-    if product_name:
-        wrap_text_to_two_lines(product_name, max_length=22, c=c, start_x=5 * mm, start_y=7.75 * mm, line_height=font_size - 1.5, max_width=25)
-    if lot:
-        c.drawString(5 * mm, 3.5 * mm, f"Lot: {lot}")
-    c.showPage()
-    c.save()
-    if os.path.exists(barcode_image):
-        os.remove(barcode_image)
-
-def generate_label_pdf(sku, upc_code, lot_num, output_path):
-    width, height = 60 * mm, 35 * mm
-    c = canvas.Canvas(output_path, pagesize=(width, height))
-    x_margin = 4.5 * mm
-    y_sku = height - 7.75 * mm
-    y_barcode = height / 2 - 8 * mm
-    y_lot = 4.75 * mm
-    barcode_width = 51.5 * mm
-    c.setFont("Helvetica", 9.5)
-    c.drawCentredString(width / 2, y_sku, sku)
-    if len(upc_code) == 12:
-        upc_code = '0' + upc_code
-    barcode_path = generate_d2c_barcode(upc_code, sku)
-    c.drawImage(barcode_path, (width - barcode_width) / 2, y_barcode, width=barcode_width, height=16 * mm)
-    os.remove(barcode_path)
-    c.setFont("Helvetica", 9)
-    if lot_num:
-        lot_box_width = 40 * mm
-        lot_box_height = 4 * mm
-        x_lot_box = (width - lot_box_width) / 2
-        y_lot_box = y_lot - 1.125 * mm
-        c.setStrokeColorRGB(0, 0, 0)
-        c.rect(x_lot_box, y_lot_box, lot_box_width, lot_box_height, stroke=1, fill=0)
-        c.drawCentredString(width / 2, y_lot, lot_num)
-    c.save()
-
-def generate_pdfs_from_excel(df):
-    required_columns = ['SKU', 'UPC Code', 'LOT#']
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        st.error(f"Missing columns in the Excel file: {', '.join(missing_columns)}")
+def show_validation_report(digest, kind, df):
+    try:
+        valid_count, invalid_rows = validate_upload(digest, kind, df)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if not invalid_rows:
+        st.success(f"{valid_count} row(s) ready to generate.")
+        return
+    st.warning(f"{len(invalid_rows)} invalid row(s) will be skipped; {valid_count} row(s) ready to generate.")
+    with st.expander("Invalid rows"):
+        st.dataframe(pd.DataFrame(invalid_rows, columns=["Excel Row", "Error"]), hide_index=True)
+
+def show_row_errors(row_errors):
+    if not row_errors:
+        return
+    st.warning(f"{len(row_errors)} row(s) were skipped.")
+    with st.expander("Row errors"):
+        st.dataframe(pd.DataFrame(row_errors, columns=["Excel Row", "Error"]), hide_index=True)
+
+def show_cache_stats(batch_stats):
+    # Counted per chunk, in whichever process rendered it, so these describe
+    # this batch only
+    barcode_hits = batch_stats.get("barcode_cache_hits", 0)
+    barcode_lookups = barcode_hits + batch_stats.get("barcode_cache_misses", 0)
+    if barcode_lookups:
+        st.caption(
+            f"Barcode cache: {barcode_hits} hits / {barcode_lookups - barcode_hits} misses "
+            f"({barcode_hits / barcode_lookups:.0%} hit rate)"
+        )
+    label_hits = batch_stats.get("label_cache_hits", 0)
+    label_lookups = label_hits + batch_stats.get("label_cache_misses", 0)
+    if label_lookups:
+        st.caption(
+            f"Label cache: {label_hits}/{label_lookups} labels reused from cache "
+            f"({label_hits / label_lookups:.0%} hit rate)"
+        )
+
+def show_label_cache_admin(module):
+    with st.sidebar.expander("Admin"):
+        unlocked = admin_unlocked()
+        if module == "Labels Generator":
+            from labels_core import label_cache
+            # Measuring walks the cache directory, so only on request
+            if st.button("Refresh label cache usage", key="label_cache_usage"):
+                usage = label_cache.usage(rescan=True)
+                st.write(
+                    f"Label cache: {usage['files']} files, "
+                    f"{usage['bytes'] / 1024 ** 2:.1f} / {usage['max_bytes'] / 1024 ** 2:.0f} MB"
+                )
+            # The cache is shared by every user of this server
+            if unlocked and st.button("Purge label cache", key="purge_label_cache"):
+                label_cache.purge()
+                st.success("Label cache purged.")
+        load = get_job_manager().load()
+        st.write(f"Jobs: {load['running']}/{load['max_running']} running, {load['queued']} queued")
+        show_lookup_admin(unlocked)
+
+def show_run_timings(run, profile):
+    with st.expander("Timing breakdown"):
+        st.dataframe(pd.DataFrame(run.rows()), hide_index=True)
+        counters = {name: value for name, value in run.counters.items() if value}
+        if counters:
+            st.caption(", ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+        if run.rss_growth is None:
+            memory = f"Process peak RSS: {run.peak_rss / 1024 ** 2:.0f} MB"
+        else:
+            memory = (
+                f"Memory: +{run.rss_growth / 1024 ** 2:.0f} MB RSS during this run "
+                f"(peak {run.peak_rss / 1024 ** 2:.0f} MB, sampled at batch stages)"
+            )
+        st.caption(
+            f"{memory}. Nested stages (a.b) are included in "
+            "their parent; with parallel workers, render stages are summed across processes."
+        )
+        if profile:
+            st.download_button("Download cProfile dump", profile["dump"], file_name="profile.prof", key="profile_dump")
+            st.code(profile["summary"])
+
+# --- RERUN CACHE ---
+# Streamlit re-executes this script on every widget interaction. Uploads are
+# keyed by a hash of their content, so parsing and validation run once per
+# file (shared across sessions, bounded by entry count and TTL). They are
+# cache_resource, not cache_data: a rerun gets the cached frame itself instead
+# of unpickling a fresh copy, so callers must treat it as read-only (the
+# lookup fill works on a copy). Finished outputs live with their background
+# job, see below.
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 60 * 60))
+UPLOAD_CACHE_ENTRIES = int(os.environ.get("UPLOAD_CACHE_ENTRIES", 64))
+
+def upload_digest(uploaded_file):
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+# Leading-underscore arguments are not hashed by Streamlit's caches; the
+# digest stands in for their content.
+@st.cache_resource(max_entries=UPLOAD_CACHE_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def read_upload(digest, name, kind, _uploaded_file):
+    from labels_core import label_upload_columns
+    columns, text_columns = label_upload_columns(kind)
+    return read_table(name, _uploaded_file.getvalue(), columns=columns, text_columns=text_columns)
+
+@st.cache_resource(max_entries=UPLOAD_CACHE_ENTRIES, ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def validate_upload(digest, kind, _df):
+    from labels_core import prepare_d2c_rows, prepare_fnsku_rows
+    prepare_rows = prepare_d2c_rows if kind == "d2c" else prepare_fnsku_rows
+    rows, invalid_rows = prepare_rows(_df)
+    return len(rows), invalid_rows
+
+# --- LOOKUPS ---
+# Blank UPC Code / Product Name cells are filled from the SKU and FNSKU
+# databases (see lookups.py) before validation. The filled values are folded
+# into the upload digest, so validation and jobs follow admin updates.
+LOOKUP_NAMES = {"sku_upc": "SKU → UPC", "fnsku_product_name": "FNSKU → Product Name"}
+
+def app_secret(name, default=None):
+    try:
+        return st.secrets.get(name, os.environ.get(name.upper(), default))
+    except FileNotFoundError:  # no secrets.toml: environment only
+        return os.environ.get(name.upper(), default)
+
+def lookup_config():
+    config = app_secret("supabase") or {}
+    return {
+        "url": config.get("url", os.environ.get("SUPABASE_URL")),
+        "key": config.get("key", os.environ.get("SUPABASE_KEY")),
+    }
+
+def lookup_service():
+    # Cheap: the database connection is only made by the first lookup
+    return get_lookup_service(lookup_config())
+
+def fill_from_lookups(digest, kind, df, run):
+    """Returns (digest, df) with blank lookup fields filled; reports what was filled."""
+    df, filled, unresolved = fill_label_fields(kind, df, lookup_service(), run.counters)
+    _, key_column, value_column = LABEL_LOOKUPS[kind]
+    if filled:
+        values = pd.util.hash_pandas_object(df[value_column], index=False).values.tobytes()
+        digest = hashlib.sha256(digest.encode("utf-8") + values).hexdigest()
+        st.info(f"Filled {filled} blank '{value_column}' cell(s) from the database.")
+    if unresolved:
+        st.warning(f"{unresolved} {key_column}(s) are not in the database; those rows will be skipped.")
+    return digest, df
+
+def admin_unlocked():
+    """Asks for the admin password (when one is configured); True once it matches."""
+    admin_password = app_secret("admin_password")
+    if not admin_password:
+        return False
+    password = st.text_input("Admin password", type="password", key="admin_password")
+    return hmac.compare_digest(password.encode("utf-8"), str(admin_password).encode("utf-8"))
+
+def show_lookup_admin(unlocked):
+    service = lookup_service()
+    st.write(f"Lookup database: {service.backend.label}")
+    st.write(f"Lookup cache: {service.cache.size()} entries in memory")
+    if st.button("Invalidate lookup cache", key="invalidate_lookups"):
+        service.invalidate()
+        st.success("Lookup cache invalidated.")
+    if not unlocked:
+        return
+    lookup = st.selectbox("Bulk update", list(LOOKUP_NAMES), format_func=LOOKUP_NAMES.get, key="bulk_update_lookup")
+    columns = list(BULK_UPDATE_COLUMNS[lookup])
+    update_file = st.file_uploader(
+        f"Excel or CSV with {' and '.join(columns)}", type=["xlsx", "xls", "csv"], key="bulk_update_file"
+    )
+    if update_file is not None and st.button("Apply bulk update", key="apply_bulk_update"):
+        try:
+            df = read_table(update_file.name, update_file.getvalue(), columns=columns, text_columns=columns)
+            updated = service.bulk_update(lookup, bulk_update_pairs(lookup, df))
+            st.success(f"{updated} row(s) updated; their cached lookups were invalidated.")
+        except Exception as e:
+            st.error(f"Bulk update failed: {e}")
+
+# --- BACKGROUND JOBS ---
+# Label batches and PL builds run on the job manager's worker threads (see
+# jobs.py) so the page stays responsive. The job key is the upload digest plus
+# the options, so a rerun or a second click finds the existing job instead of
+# starting another one. The client id lives in the URL, so a refresh reconnects
+# to the same jobs and their downloads.
+JOB_POLL_SECONDS = 1.0
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PL_ZIP_NAME = "packing_lists.zip"
+
+def client_id():
+    if "client" not in st.query_params:
+        st.query_params["client"] = uuid.uuid4().hex[:12]
+    return st.query_params["client"]
+
+def submit_job(key, title, target):
+    try:
+        return get_job_manager().submit(client_id(), key, title, target)
+    except JobRejected as e:
+        st.error(str(e))
         return None
-    first_sku = df.iloc[0]['SKU']
-    current_date = datetime.now().strftime("%Y%m%d")
-    output_folder = f"{first_sku}_{current_date}"
-    os.makedirs(output_folder, exist_ok=True)
-    total_rows = len(df)
-    progress_bar = st.progress(0)
-    for index, row in df.iterrows():
-        sku = row['SKU']
-        upc_code = str(row['UPC Code']).zfill(12)
-        lot_num = row['LOT#'] if pd.notnull(row['LOT#']) else ""
-        pdf_filename = clean_filename(f"{sku}.pdf")
-        pdf_path = os.path.join(output_folder, pdf_filename)
-        generate_label_pdf(sku, upc_code, lot_num, pdf_path)
-        progress_bar.progress((index + 1) / total_rows)
-    zip_filename = f"{output_folder}.zip"
-    with ZipFile(zip_filename, 'w') as zipObj:
-        for folder_name, subfolders, filenames in os.walk(output_folder):
-            for filename in filenames:
-                filepath = os.path.join(folder_name, filename)
-                zipObj.write(filepath, os.path.basename(filepath))
-    return zip_filename
-
-def generate_fnsku_labels_from_excel(df):
-    first_fnsku = df.iloc[0]['FNSKU']
-    current_date = datetime.now().strftime("%Y%m%d")
-    output_folder = f"{first_fnsku}_{current_date}"
-    os.makedirs(output_folder, exist_ok=True)
-    total_rows = len(df)
-    progress_bar = st.progress(0)
-    for index, row in df.iterrows():
-        fnsku = str(row['FNSKU']) if pd.notna(row['FNSKU']) else ""
-        product_name = str(row['Product Name']) if pd.notna(row['Product Name']) else ""
-        lot = str(row['LOT#']) if pd.notna(row['LOT#']) else ""
-        barcode_image = generate_fnsku_barcode(fnsku)
-        create_fnsku_pdf(barcode_image, fnsku, product_name, lot, output_folder)
-        progress_bar.progress((index + 1) / total_rows)
-    zip_filename = f"{output_folder}.zip"
-    with ZipFile(zip_filename, 'w') as zipObj:
-        for folder_name, subfolders, filenames in os.walk(output_folder):
-            for filename in filenames:
-                if "_fnsku_label" in filename:
-                    filepath = os.path.join(folder_name, filename)
-                    zipObj.write(filepath, os.path.basename(filepath))
-    return zip_filename
-
-# --- PL BUILDER STARTS HERE ---
-# Optional: clean up inconsistent location names for standardization
-LOCATION_MAP = {
-    "JD NJ : JD NJ - AMZ FBA": "JD NJ - AMZ FBA",
-    "JD Canada : JD Canada - AMZ FBA": "JD CANADA - AMZ FBA",
-    "JD UK : JD UK - AMZ FBA": "JD UK - AMZ FBA",
-    "JD AU : JD AU - AMZ FBA": "JD AU - AMZ FBA",
-    "AMAZON FBA CA": "AMAZON FBA CANADA",
-    "Amazon FBA UK": "AMAZON FBA UK",
-    "JD - Belk": "JD CA - BELK",
-    "JD - Showcase": "JD CANADA - SHOWCASE",
-    "JD Canada": "JD CANADA",
-    "JD CA - Walmart": "JD CA - WALMART",
-    "JD - Nordstrom.com": "JD CA - NORDSTROM.COM",
-    "JD - Nordstrom Stores": "JD CA - NORDSTROM STORES",
-    "JD CA - Macy's": "JD CA - MACY'S",
-    "JD NJ - Macy's": "JD CA - MACY'S",
-    "JD ATL - Macy's": "JD CA - MACY'S",
-    "Kenz - SALASA": "SALAZA SA - KENZ",
-    "Kenz - SALASA": "SALAZA SA",
-    "JD Canada - Walmart": "JD CANADA - WALMART",
-    "Lateral TJ": "LATERAL TJ"
-    
-
-
-    
-    # You can keep expanding this list as needed
-}
 
-def build_pl_base(df, transformation=False):
-    df = df.copy()
-
-    required_cols = [
-        'TO', 'FOP SO #', 'From Loc', 'To Loc',
-        'SKU External ID', 'Required Qty', 'Shipping Method'
-    ]
-    if transformation:
-        required_cols.append('Destination SKU')
-
-    missing = [col for col in required_cols if col not in df.columns]
-    if missing:
-        st.error(f"Missing required columns: {', '.join(missing)}")
-        return None, None
-
-    # === FILE NAMING LOGIC ===
-    to = df['TO'].iloc[0]
-    so = df['FOP SO #'].iloc[0]
-    from_loc = df['From Loc'].iloc[0]
-    to_loc = df['To Loc'].iloc[0]
-
-    total_qty = None
-
-    # Try to extract from 'Total QTY' if there's a 'Total' row
-    if 'Total QTY' in df.columns:
-        total_row = df[df['TO'].astype(str).str.lower().str.strip() == 'total']
-        if total_row.empty and 'Trafilea SKU' in df.columns:
-            total_row = df[df['Trafilea SKU'].astype(str).str.lower().str.strip() == 'total']
-
-        if not total_row.empty:
-            qty_val = total_row.iloc[0].get('Total QTY')
-            if pd.notna(qty_val) and float(qty_val) > 0:
-                total_qty = int(float(qty_val))
-
-    # Fallback if Total QTY is missing or invalid
-    if total_qty is None:
-        filtered_df = df[~df['TO'].astype(str).str.lower().str.strip().eq('total')]
-        total_qty = int(pd.to_numeric(filtered_df['Required Qty'], errors='coerce').sum())
-
-    filename = f"{to} + {so} + {from_loc} + {to_loc} + {total_qty} Units.xlsx"
-
-    # === OUTPUT COLUMNS ===
-    headers = [
-        "TO", "SO #", "From Loc", "To Loc", "Trafilea SKU", "Required Qty",
-        "Shipping Method", "FG", "LOT", "Expiration Date", "CARTONS",
-        "UNITS/Ctn", "Total QTY", "Carton Dimensions(inch) ", "Carton WEIGHT-LB",
-        "Pallet Dimensions", "Pallet WEIGHT-LB.", "Pallet #"
-    ]
-
-    if transformation:
-        headers.insert(5, "Destination SKU")
-
-    output_df = pd.DataFrame(columns=headers)
-    output_df['TO'] = df['TO']
-    output_df['SO #'] = df['FOP SO #']
-    output_df['From Loc'] = df['From Loc']
-    output_df['To Loc'] = df['To Loc']
-    output_df['Trafilea SKU'] = df['SKU External ID']
-    output_df['Required Qty'] = df['Required Qty']
-    output_df['Shipping Method'] = df['Shipping Method']
-
-    if transformation and 'Destination SKU' in df.columns:
-        output_df['Destination SKU'] = df['Destination SKU']
-    if 'Total QTY' in df.columns:
-        output_df['Total QTY'] = df['Total QTY']
-
-    # === EXCEL EXPORT ===
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        output_df.to_excel(writer, index=False, sheet_name='PL')
-        workbook = writer.book
-        worksheet = writer.sheets['PL']
-
-        dark_blue = workbook.add_format({
-            'bold': True, 'bg_color': '#0C2D63', 'font_color': 'white',
-            'border': 1, 'align': 'center', 'valign': 'vcenter'
-        })
-        light_blue = workbook.add_format({
-            'bold': True, 'bg_color': '#D9EAF7', 'border': 1,
-            'align': 'center', 'valign': 'vcenter'
-        })
-
-        for col_num, col_name in enumerate(output_df.columns):
-            header_format = dark_blue if col_name in [
-                "TO", "SO #", "From Loc", "To Loc", "Trafilea SKU", "Destination SKU", "Required Qty", "Shipping Method"
-            ] else light_blue
-            worksheet.write(0, col_num, col_name, header_format)
-            worksheet.set_column(col_num, col_num, 22)
+def needs_submit(job):
+    return job is None or job.status in (FAILED, CANCELLED)
 
-    output.seek(0)
-    return output, filename
+LABEL_OUTPUTS = {
+    "ZIP of individual PDFs": ("zip", "ZIP", "application/zip"),
+    "Single multi-page PDF": ("pdf", "PDF", "application/pdf"),
+    "ZPL (Zebra printers)": ("zpl", "ZPL", "application/octet-stream"),
+}
+
+def label_job(df, run, key, workers, profile_runs):
+    """Job target for key = (digest, kind, layout, vector_barcodes, output_mode)."""
+    _, kind, layout, vector_barcodes, output_mode = key
+    output_format, _, mime = LABEL_OUTPUTS[output_mode]
+
+    def target(progress_callback):
+        from labels_core import generate_labels
+        with profiled(profile_runs) as profile:
+            output, filename, row_errors, batch_stats = generate_labels(
+                kind, df, output_format, vector_barcodes=vector_barcodes,
+                workers=workers, progress_callback=progress_callback, layout=layout
+            )
+        run.merge_stats(batch_stats)
+        data = None
+        if output:
+            with output, recording(run), stage("download_prepare"):
+                data = output.read()
+        log_run(
+            "label_batch", run, kind=kind, layout=layout, rows=len(df), workers=workers,
+            vector_barcodes=vector_barcodes, output_format=output_format
+        )
+        return {
+            "data": data, "filename": filename, "row_errors": row_errors, "stats": batch_stats,
+            "run": run, "profile": profile, "artifacts": [(filename, data, mime)] if data else [],
+        }
+    return target
+
+def pl_job(uploads, split, profile_runs):
+    """Job target building the PLs for (name, bytes) uploads, plus a ZIP of all of them."""
+    def target(progress_callback):
+        from pl_builder import build_pl_files, zip_pl_files
+        run = Instrumentation()
+        with recording(run), profiled(profile_runs) as profile:
+            entries = build_pl_files(uploads, progress_callback=progress_callback, split=split)
+            built = [entry for entry in entries if "data" in entry]
+            with stage("zip_write"):
+                zip_data = zip_pl_files(entries) if len(built) > 1 else None
+        run.counters["files"] += len(uploads)
+        run.counters["pls_built"] += len(built)
+        run.counters["files_failed"] += len(entries) - len(built)
+        log_run("pl_build", run)
+        if zip_data:
+            artifacts = [(PL_ZIP_NAME, zip_data, "application/zip")]
+        else:
+            artifacts = [(entry["filename"], entry["data"], XLSX_MIME) for entry in built]
+        return {"entries": entries, "zip": zip_data, "run": run, "profile": profile, "artifacts": artifacts}
+    return target
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None or not job.active:
+        st.rerun()  # finished: redraw the whole page with the result
+    text = "Waiting for a free worker..." if job.status == QUEUED else f"{job.title}: {job.progress:.0%}"
+    st.progress(job.progress, text=text)
+    if st.button("Cancel", key=f"cancel_{job.id}"):
+        job.cancel()
+        st.rerun()
+
+def show_job(job, show_result):
+    if job is None:
+        return
+    if job.active:
+        show_job_progress(job.id)
+    elif job.status == FAILED:
+        st.error(job.error)
+    elif job.status == CANCELLED:
+        st.info("Job cancelled.")
+    elif job.status == DONE:
+        show_result(job.result)
+
+def show_label_output(result, download_label):
+    show_row_errors(result["row_errors"])
+    if result["data"]:
+        st.download_button(download_label, result["data"], file_name=result["filename"])
+        show_cache_stats(result["stats"])
+    show_run_timings(result["run"], result["profile"])
+
+def show_pl_output(result):
+    if result["zip"]:
+        built = sum("data" in entry for entry in result["entries"])
+        st.download_button(
+            f"⬇️ Download all {built} PLs (ZIP)", result["zip"], file_name=PL_ZIP_NAME,
+            mime="application/zip", key="download_all_pls", type="primary"
+        )
+    for i, entry in enumerate(result["entries"]):
+        if "error" in entry:
+            st.error(f"❌ Error processing file '{entry['name']}': {entry['error']}")
+            continue
+        filename = entry["filename"]
+        with st.container():
+            st.markdown(
+                f"<p style='margin-bottom: 0.25em;'><strong>📄 {filename}</strong></p>",
+                unsafe_allow_html=True
+            )
+
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                st.markdown(
+                    f"""
+                    <a href="{entry['form_link']}" target="_blank" style="text-decoration: none;">
+                        <button style='
+                            padding: 0.4em 1em;
+                            font-size: 14px;
+                            border: 1px solid #999;
+                            border-radius: 6px;
+                            background-color: #f4f4f4;
+                            color: #000;
+                            width: 100%;
+                        '>📝 Fill TO Template</button>
+                    </a>
+                    """,
+                    unsafe_allow_html=True
+                )
+            with col2:
+                st.download_button(
+                    label="⬇️ Download PL Excel",
+                    data=entry["data"],
+                    file_name=filename,
+                    mime=XLSX_MIME,
+                    key=f"pl_{i}_{filename}",
+                    use_container_width=True
+                )
+    show_run_timings(result["run"], result["profile"])
+
+def prepare_job_download(job_id):
+    st.session_state["prepared_job"] = job_id
+
+def show_jobs_sidebar():
+    jobs = get_job_manager().jobs_for(client_id())
+    if not jobs:
+        return
+    active = sum(job.active for job in jobs)
+    # A download button ships its bytes to the browser on every rerun, so only
+    # the job the user picked gets them, not every finished artifact
+    prepared = st.session_state.get("prepared_job")
+    with st.sidebar.expander(f"Your jobs ({active} in progress)", expanded=bool(active)):
+        for job in jobs:
+            status = f"{job.status} {job.progress:.0%}" if job.active else job.status
+            st.caption(f"{job.title}: {status}")
+            if job.status != DONE or not job.result["artifacts"]:
+                continue
+            if job.id != prepared:
+                st.button("Prepare download", key=f"prepare_{job.id}", on_click=prepare_job_download, args=(job.id,))
+                continue
+            for i, (filename, data, mime) in enumerate(job.result["artifacts"]):
+                st.download_button(f"⬇️ {filename}", data, file_name=filename, mime=mime, key=f"job_{job.id}_{i}")
 
 # --- STREAMLIT APP UI ---
 
+configure_logging()
 st.set_page_config(page_title="TOs Hub", layout="wide")
 st.title("TOs Hub")
 
 st.sidebar.title("Navigation")
-module = st.sidebar.radio("Go to:", ["Labels Generator", "PL Builder"])
+module = st.sidebar.radio("Go to:", ["Labels Generator", "PL Builder"], key="nav_module")
+show_label_cache_admin(module)
+show_jobs_sidebar()
+profile_runs = st.sidebar.checkbox(
+    "Profile runs (cProfile)",
+    key="profile_runs",
+    help="Profiles each generation in this process (not the parallel workers) and offers the dump for download."
+)
 
 if module == "Labels Generator":
+    from labels_core import LABEL_LAYOUTS, QUANTITY_COLUMN, default_worker_count, layouts_for
     st.header("Labels Generator")
     show_template_download_buttons()
     option = st.selectbox("Choose an action", ["Generate D2C Labels", "Generate FNSKU Labels"], key="action_select")
+    barcode_mode = st.radio(
+        "Barcode rendering",
+        ["Raster (PNG)", "Vector"],
+        horizontal=True,
+        key="barcode_mode",
+        help="Vector draws the bars directly into the PDF: smaller files, crisper prints."
+    )
+    vector_barcodes = barcode_mode == "Vector"
+    output_mode = st.radio(
+        "Output",
+        list(LABEL_OUTPUTS),
+        horizontal=True,
+        key="output_mode",
+        help=(
+            f"Single PDF and ZPL print in one go; an optional '{QUANTITY_COLUMN}' column repeats each label N times. "
+            "ZPL is sent straight to Zebra thermal printers, which draw the barcodes natively."
+        )
+    )
+    file_kind = LABEL_OUTPUTS[output_mode][1]
+    workers = st.number_input(
+        "Parallel workers",
+        min_value=1,
+        max_value=default_worker_count(),
+        value=1,
+        step=1,
+        key="label_workers",
+        help="1 renders in this process; more splits the batch across CPU cores."
+    )
+
+    kind = "d2c" if option == "Generate D2C Labels" else "fnsku"
+    layout = st.selectbox(
+        "Label size",
+        layouts_for(kind),
+        format_func=lambda name: "{} x {} mm".format(*LABEL_LAYOUTS[name]["page_size_mm"]),
+        key=f"{kind}_layout"
+    )
+    lookup_field = LABEL_LOOKUPS[kind][2]
+    use_lookups = st.checkbox(
+        f"Fill blank {lookup_field} from the database",
+        # Off by default when only the empty local stand-in is available
+        value=lookups_configured(lookup_config()),
+        key="use_lookups",
+        help=f"The '{lookup_field}' column may be left out or partly blank; it is looked up in bulk by {LABEL_LOOKUPS[kind][1]}."
+    )
+    if use_lookups:
+        st.caption(f"Lookup database: {lookup_service().backend.label}")
 
     if option == "Generate D2C Labels":
-        st.write("Upload an Excel file with SKU, UPC, and LOT# (if applicable)")
-        uploaded_file = st.file_uploader("Upload Excel file", type=["xlsx", "xls"], key="excel_uploader")
+        st.write("Upload an Excel or CSV file with SKU, UPC, and LOT# (if applicable)")
+        uploaded_file = st.file_uploader("Upload Excel or CSV file", type=["xlsx", "xls", "csv"], key="excel_uploader")
         if uploaded_file is not None:
             try:
-                df = pd.read_excel(uploaded_file, engine='openpyxl' if uploaded_file.name.endswith('xlsx') else 'xlrd')
-                if st.button("Generate D2C Labels", key="generate_d2c_labels"):
-                    zip_path = generate_pdfs_from_excel(df)
-                    if zip_path:
-                        with open(zip_path, "rb") as f:
-                            st.download_button("Download ZIP file with Labels", f, file_name=zip_path)
+                run = Instrumentation()
+                with recording(run), stage("read_upload"):
+                    digest = upload_digest(uploaded_file)
+                    df = read_upload(digest, uploaded_file.name, kind, uploaded_file)
+                if use_lookups:
+                    with recording(run), stage("lookup"):
+                        digest, df = fill_from_lookups(digest, kind, df, run)
+                with recording(run), stage("validation_report"):
+                    show_validation_report(digest, kind, df)
+                output_key = (digest, kind, layout, vector_barcodes, output_mode)
+                job = get_job_manager().find(client_id(), output_key)
+                if st.button("Generate D2C Labels", key="generate_d2c_labels") and needs_submit(job):
+                    job = submit_job(
+                        output_key, f"D2C labels ({uploaded_file.name})",
+                        label_job(df, run, output_key, workers, profile_runs)
+                    )
+                show_job(job, lambda result: show_label_output(result, f"Download {file_kind} file with Labels"))
             except Exception as e:
-                st.error(f"Error reading the Excel file: {e}")
+                st.error(f"Error reading the uploaded file: {e}")
 
     elif option == "Generate FNSKU Labels":
-        st.write("Upload an Excel file with SKU, FNSKU, and LOT# (if applicable)")
-        uploaded_file = st.file_uploader("Upload Excel file", type=["xlsx", "xls"], key="excel_fnsku_uploader")
+        st.write("Upload an Excel or CSV file with SKU, FNSKU, and LOT# (if applicable)")
+        uploaded_file = st.file_uploader("Upload Excel or CSV file", type=["xlsx", "xls", "csv"], key="excel_fnsku_uploader")
         if uploaded_file is not None:
             try:
-                df = pd.read_excel(uploaded_file, engine='openpyxl' if uploaded_file.name.endswith('xlsx') else 'xlrd')
-                if st.button("Generate FNSKU Labels", key="generate_fnsku_labels"):
-                    zip_path = generate_fnsku_labels_from_excel(df)
-                    if zip_path:
-                        with open(zip_path, "rb") as f:
-                            st.download_button("Download ZIP file with FNSKU Labels", f, file_name=zip_path)
+                run = Instrumentation()
+                with recording(run), stage("read_upload"):
+                    digest = upload_digest(uploaded_file)
+                    df = read_upload(digest, uploaded_file.name, kind, uploaded_file)
+                if use_lookups:
+                    with recording(run), stage("lookup"):
+                        digest, df = fill_from_lookups(digest, kind, df, run)
+                with recording(run), stage("validation_report"):
+                    show_validation_report(digest, kind, df)
+                output_key = (digest, kind, layout, vector_barcodes, output_mode)
+                job = get_job_manager().find(client_id(), output_key)
+                if st.button("Generate FNSKU Labels", key="generate_fnsku_labels") and needs_submit(job):
+                    job = submit_job(
+                        output_key, f"FNSKU labels ({uploaded_file.name})",
+                        label_job(df, run, output_key, workers, profile_runs)
+                    )
+                show_job(job, lambda result: show_label_output(result, f"Download {file_kind} file with FNSKU Labels"))
             except Exception as e:
-                st.error(f"Error reading the Excel file: {e}")
+                st.error(f"Error reading the uploaded file: {e}")
 
 elif module == "PL Builder":
     st.header("📦 Packing List Builder")
@@ -381,88 +569,22 @@ elif module == "PL Builder":
         accept_multiple_files=True
     )
 
+    split_exports = st.checkbox(
+        "Split consolidated exports by TO",
+        key="pl_split",
+        help="For ERP exports with many TOs in one sheet: builds one PL (and form link) per TO / FOP SO #."
+    )
+
     if uploaded_files:
         st.success(f"{len(uploaded_files)} file(s) uploaded successfully.")
         st.markdown("### 📝 Processed Packing Lists")
 
-        for uploaded_file in uploaded_files:
-            try:
-                if uploaded_file.name.endswith(".csv"):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(
-                        uploaded_file,
-                        engine='openpyxl' if uploaded_file.name.endswith('xlsx') else 'xlrd'
-                    )
-
-                # Normalize column names
-                df.columns = [col.strip() for col in df.columns]
-                is_transformation = any("destination sku" in col.lower() for col in df.columns)
-                output, filename = build_pl_base(df, transformation=is_transformation)
-
-                if output:
-                    # --- Extract values for prefill ---
-                    raw_to = df['TO'].iloc[0]
-                    raw_so = df['FOP SO #'].iloc[0]
-                    raw_from_loc = df['From Loc'].iloc[0]
-                    raw_to_loc = df['To Loc'].iloc[0]
-                    raw_shipping = df['Shipping Method'].iloc[0]
-
-                    from_loc = LOCATION_MAP.get(str(raw_from_loc).strip(), str(raw_from_loc).strip())
-                    to_loc = LOCATION_MAP.get(str(raw_to_loc).strip(), str(raw_to_loc).strip())
-
-                    filtered_df = df[~df['TO'].astype(str).str.lower().str.strip().eq('total')]
-                    qty = int(pd.to_numeric(filtered_df['Required Qty'], errors='coerce').sum())
-                    sku_count = filtered_df['SKU External ID'].nunique()
-
-                    def enc(val): return urllib.parse.quote_plus(str(val))
-                    form_link = (
-                        "https://docs.google.com/forms/d/e/1FAIpQLSelQ08zk5O1py2t5czsuW4jnpVYO22LAtMskBxlbk__WuRgmA/viewform"
-                        f"?entry.811040286={enc(raw_to)}"
-                        f"&entry.771037158={enc(raw_so)}"
-                        f"&entry.75050938={qty}"
-                        f"&entry.2087058692={sku_count}"
-                        f"&entry.227202689={enc(from_loc)}"
-                        f"&entry.855389021={enc(to_loc)}"
-                        f"&entry.105986750={enc(raw_shipping)}"
-                    )
-
-                    with st.container():
-                        st.markdown(
-                            f"<p style='margin-bottom: 0.25em;'><strong>📄 {filename}</strong></p>",
-                            unsafe_allow_html=True
-                        )
-
-                        col1, col2 = st.columns([1, 1])
-                        with col1:
-                            st.markdown(
-                                f"""
-                                <a href="{form_link}" target="_blank" style="text-decoration: none;">
-                                    <button style='
-                                        padding: 0.4em 1em;
-                                        font-size: 14px;
-                                        border: 1px solid #999;
-                                        border-radius: 6px;
-                                        background-color: #f4f4f4;
-                                        color: #000;
-                                        width: 100%;
-                                    '>📝 Fill TO Template</button>
-                                </a>
-                                """,
-                                unsafe_allow_html=True
-                            )
-                        with col2:
-                            st.download_button(
-                                label="⬇️ Download PL Excel",
-                                data=output,
-                                file_name=filename,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key=filename,
-                                use_container_width=True
-                            )
-
-            except Exception as e:
-                st.error(f"❌ Error processing file '{uploaded_file.name}': {e}")
+        uploads = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+        pl_key = ("pl", split_exports) + tuple(hashlib.sha256(data).hexdigest() for _, data in uploads)
+        job = get_job_manager().find(client_id(), pl_key)
+        if job is None or (needs_submit(job) and st.button("Retry", key="retry_pl")):
+            job = submit_job(pl_key, f"{len(uploads)} PL(s)", pl_job(uploads, split_exports, profile_runs))
+        show_job(job, show_pl_output)
 
     st.markdown(
         """
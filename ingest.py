@@ -0,0 +1,56 @@
+"""
+Upload ingestion shared by the Labels Generator and the PL Builder.
+
+Uploads are parsed from bytes with only the columns a module needs: every
+other column is skipped by the reader instead of being parsed and thrown away.
+Identifier columns are read as strings, so UPCs, SKUs and SO numbers keep
+leading zeros and never pass through float. Excel files go through calamine
+(Rust) when python-calamine is installed and fall back to openpyxl/xlrd
+otherwise.
+"""
+import importlib.util
+from io import BytesIO
+
+import pandas as pd
+
+HAS_CALAMINE = importlib.util.find_spec("python_calamine") is not None
+
+def excel_engine(name):
+    if HAS_CALAMINE:
+        return "calamine"
+    return "xlrd" if name.lower().endswith(".xls") else "openpyxl"
+
+def _column_filter(columns, match):
+    wanted = {column.strip() for column in columns}
+
+    def keep(column):
+        column = str(column).strip()
+        return column in wanted or (match is not None and match(column))
+    return keep
+
+def _text_dtypes(header, text_columns):
+    # usecols matches stripped names but dtype needs the names as the file
+    # spells them, so "UPC Code " must be keyed with its trailing space
+    wanted = {column.strip() for column in text_columns}
+    return {column: str for column in header if str(column).strip() in wanted}
+
+def read_table(name, data, columns=None, text_columns=(), match=None):
+    """
+    Read a CSV or Excel upload from bytes into a DataFrame with stripped
+    column names. If columns is given, only those (and any column for which
+    match(name) is true) are parsed. text_columns are read as strings; empty
+    cells stay NaN.
+    """
+    usecols = _column_filter(columns, match) if columns is not None else None
+    if name.lower().endswith(".csv"):
+        def read(**kwargs):
+            return pd.read_csv(BytesIO(data), encoding="utf-8-sig", **kwargs)
+        dtype = _text_dtypes(read(nrows=0).columns, text_columns) if text_columns else None
+        df = read(usecols=usecols, dtype=dtype)
+    else:
+        # One workbook for both the header row and the data
+        with pd.ExcelFile(BytesIO(data), engine=excel_engine(name)) as book:
+            dtype = _text_dtypes(book.parse(nrows=0).columns, text_columns) if text_columns else None
+            df = book.parse(usecols=usecols, dtype=dtype)
+    df.columns = [str(column).strip() for column in df.columns]
+    return df
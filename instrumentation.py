@@ -0,0 +1,180 @@
+"""
+Lightweight per-stage timing for the label generators and the PL builder.
+
+Code on the hot path wraps its work in `with stage("name"):` and bumps
+counters with `count("name")`. Both are no-ops unless an Instrumentation is
+recording on the current thread, so library callers that don't care pay next
+to nothing. Results travel between processes as flat stats dicts
+("<stage>_sec", "<stage>_calls", "peak_rss_bytes", "rss_growth_bytes") which
+merge by summing (memory by max), the same shape the label batch stats
+already use. Memory is per run: resident size is sampled when recording
+starts and ends, in to_stats() and after batch-level stages opened with
+stage(name, sample=True), so a long-lived server or pool worker reports
+what this run used rather than its all-time high. Per-label stages don't
+sample; reading /proc costs more than timing them.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from tempfile import gettempdir
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger("tos_hub.timings")
+
+_local = threading.local()
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss_bytes():
+    """Resident set size right now, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss_bytes():
+    """High-water mark of the whole process lifetime, not of any one run."""
+    if resource is None:
+        return 0
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Instrumentation:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.peak_rss = 0
+        # None where current RSS can't be read; peak_rss is then the process peak
+        self.rss_growth = None
+        self._rss_start = None
+
+    def add(self, name, seconds, calls=1):
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+
+    def sample_memory(self):
+        rss = current_rss_bytes()
+        if rss is None:
+            self.peak_rss = max(self.peak_rss, peak_rss_bytes())
+            return
+        if self._rss_start is None:
+            self._rss_start = rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.rss_growth = max(self.rss_growth or 0, rss - self._rss_start)
+
+    def merge_stats(self, stats):
+        for key, value in stats.items():
+            if key == "peak_rss_bytes":
+                self.peak_rss = max(self.peak_rss, value)
+            elif key == "rss_growth_bytes":
+                self.rss_growth = max(self.rss_growth or 0, value)
+            elif key.endswith("_sec"):
+                self.seconds[key[:-len("_sec")]] += value
+            elif key.endswith("_calls"):
+                self.calls[key[:-len("_calls")]] += value
+            else:
+                self.counters[key] += value
+
+    def to_stats(self):
+        self.sample_memory()
+        stats = dict(self.counters)
+        for name, seconds in self.seconds.items():
+            stats[f"{name}_sec"] = seconds
+            stats[f"{name}_calls"] = self.calls[name]
+        stats["peak_rss_bytes"] = self.peak_rss
+        if self.rss_growth is not None:
+            stats["rss_growth_bytes"] = self.rss_growth
+        return stats
+
+    def rows(self):
+        """Stage rows sorted by name, so nested "a.b" stages sit under "a"."""
+        return [
+            {"Stage": name, "Seconds": round(self.seconds[name], 4), "Calls": self.calls[name]}
+            for name in sorted(self.seconds)
+        ]
+
+def current():
+    return getattr(_local, "current", None)
+
+@contextmanager
+def recording(instrumentation):
+    previous = current()
+    _local.current = instrumentation
+    instrumentation.sample_memory()
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.sample_memory()
+        _local.current = previous
+
+def count(name, amount=1):
+    """Add to a counter of the recording Instrumentation; a no-op otherwise."""
+    instrumentation = current()
+    if instrumentation is not None:
+        instrumentation.counters[name] += amount
+
+@contextmanager
+def stage(name, sample=False):
+    instrumentation = current()
+    if instrumentation is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        instrumentation.add(name, perf_counter() - started)
+        if sample:
+            instrumentation.sample_memory()
+
+def log_run(event, instrumentation, **fields):
+    """Emit one structured (JSON) log line for a finished run."""
+    record = {"event": event, **fields, **instrumentation.to_stats()}
+    logger.info(json.dumps(record, default=str, sort_keys=True))
+
+def configure_logging(level=logging.INFO):
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+@contextmanager
+def profiled(enabled):
+    """
+    Run the block under cProfile when enabled. Yields a dict that receives
+    "dump" (bytes, loadable with pstats) and "summary" (top functions as text)
+    once the block exits. Only the calling process is profiled.
+    """
+    result = {}
+    if not enabled:
+        yield result
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(30)
+        result["summary"] = summary.getvalue()
+        dump_path = os.path.join(gettempdir(), f"profile-{os.getpid()}-{threading.get_ident()}.prof")
+        profiler.dump_stats(dump_path)
+        with open(dump_path, "rb") as f:
+            result["dump"] = f.read()
+        os.remove(dump_path)
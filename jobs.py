@@ -0,0 +1,175 @@
+"""
+In-process background jobs for label batches and PL builds.
+
+The Streamlit handler submits a job and returns immediately; a bounded thread
+pool runs it while the page polls progress. Jobs live in this module (not in
+session state), so a page refresh reconnects to them by owner id, and finished
+artifacts stay downloadable until they expire. Admission control caps how many
+heavy jobs the server runs and queues at once, and how many one owner can have
+active.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import process_singleton
+
+MAX_RUNNING_JOBS = int(os.environ.get("MAX_RUNNING_JOBS", 2))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 8))
+MAX_ACTIVE_JOBS_PER_OWNER = int(os.environ.get("MAX_ACTIVE_JOBS_PER_OWNER", 2))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 60 * 60))
+# Finished artifacts kept per owner; the oldest finished jobs go first
+OWNER_RESULT_MAX_BYTES = int(os.environ.get("SESSION_OUTPUT_MAX_BYTES", 256 * 1024 * 1024))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class JobCancelled(Exception):
+    pass
+
+class JobRejected(Exception):
+    pass
+
+class Job:
+    def __init__(self, owner, key, title):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.key = key
+        self.title = title
+        self.status = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel_requested = threading.Event()
+        self._future = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def result_bytes(self):
+        if not self.result:
+            return 0
+        return sum(len(data) for _, data, _ in self.result.get("artifacts", ()))
+
+    def report_progress(self, fraction):
+        """Progress callback handed to the job; raises JobCancelled once cancel() was called."""
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+        self.progress = fraction
+
+    def cancel(self):
+        self._cancel_requested.set()
+        if self._future is not None and self._future.cancel():
+            # Never started
+            self.status = CANCELLED
+            self.finished = time.time()
+
+class JobManager:
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS,
+                 max_active_per_owner=MAX_ACTIVE_JOBS_PER_OWNER, retention_seconds=JOB_RETENTION_SECONDS,
+                 owner_result_max_bytes=OWNER_RESULT_MAX_BYTES):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_active_per_owner = max_active_per_owner
+        self.retention_seconds = retention_seconds
+        self.owner_result_max_bytes = owner_result_max_bytes
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="tos-hub-job")
+
+    def submit(self, owner, key, title, target):
+        """
+        Queue target(progress_callback) and return its Job. target returns a
+        result dict; an optional "artifacts" list of (filename, bytes, mime)
+        counts towards the owner's result budget. Raises JobRejected when the
+        server or the owner is at capacity.
+        """
+        with self._lock:
+            self._expire()
+            active = [job for job in self._jobs.values() if job.active]
+            if len(active) >= self.max_running + self.max_queued:
+                raise JobRejected("The server is busy with other jobs. Please try again in a few minutes.")
+            if sum(job.owner == owner for job in active) >= self.max_active_per_owner:
+                raise JobRejected(
+                    f"You already have {self.max_active_per_owner} job(s) in progress. "
+                    "Wait for one to finish or cancel it."
+                )
+            job = Job(owner, key, title)
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job, target)
+        return job
+
+    def _run(self, job, target):
+        if job._cancel_requested.is_set():
+            job.status = CANCELLED
+            job.finished = time.time()
+            return
+        job.status = RUNNING
+        try:
+            job.result = target(job.report_progress)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._enforce_owner_budget(job)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find(self, owner, key):
+        """Latest job for (owner, key), whatever its status, or None."""
+        with self._lock:
+            self._expire()
+            for job in reversed(self._jobs.values()):
+                if job.owner == owner and job.key == key:
+                    return job
+        return None
+
+    def jobs_for(self, owner):
+        with self._lock:
+            self._expire()
+            return [job for job in reversed(self._jobs.values()) if job.owner == owner]
+
+    def load(self):
+        with self._lock:
+            active = [job for job in self._jobs.values() if job.active]
+        running = sum(job.status == RUNNING for job in active)
+        return {"running": running, "queued": len(active) - running, "max_running": self.max_running}
+
+    def _expire(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _enforce_owner_budget(self, latest):
+        # The job that just finished is always kept, even if it alone is over budget
+        finished = [job for job in self._jobs.values() if job.owner == latest.owner and not job.active]
+        total = sum(job.result_bytes for job in finished)
+        for job in finished:  # oldest first
+            if total <= self.owner_result_max_bytes:
+                break
+            if job is latest:
+                continue
+            total -= job.result_bytes
+            del self._jobs[job.id]
+
+@process_singleton
+def get_job_manager():
+    # Also outlives page refreshes, which reconnect by owner id
+    return JobManager()
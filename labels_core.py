@@ -0,0 +1,1163 @@
+"""
+Label rendering for the TOs Hub Labels Generator.
+
+Everything here is free of Streamlit so it can run inside worker processes
+and headlessly (cli.py); callers pass progress and error callbacks and
+present the results themselves.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from datetime import datetime
+from io import BytesIO
+from multiprocessing import get_context
+from tempfile import SpooledTemporaryFile, gettempdir, mkstemp
+from zipfile import ZipFile
+
+import barcode
+import numpy as np
+import pandas as pd
+import reportlab
+from barcode import EAN13, Code128
+from barcode.writer import BaseWriter, ImageWriter, pt2mm
+from reportlab.lib.pagesizes import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+
+from instrumentation import Instrumentation, count, recording, stage
+from shared import chunked, process_singleton, unique_name
+
+INVALID_FILENAME_CHARS = r'[<>:"/\\|?*]'
+
+def clean_filename(name):
+    return re.sub(INVALID_FILENAME_CHARS, '', name)
+
+# --- BARCODE CACHE ---
+# Barcodes are rendered into memory and kept in a bounded LRU keyed by content
+# (symbology, code, writer options), so repeated FNSKUs/UPCs are encoded once
+# and nothing is written to the working directory.
+BARCODE_CACHE_SIZE = 1024
+
+FNSKU_WRITER_OPTIONS = {
+    'module_width': 0.35,
+    'module_height': 16,
+    'font_size': 7.75,
+    'text_distance': 4.5,
+    'quiet_zone': 1.25,
+    'dpi': 600
+}
+D2C_WRITER_OPTIONS = {}
+
+class BarcodeCache:
+    def __init__(self, maxsize=BARCODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        # Hits and misses are counted on the recording batch, not here: the
+        # cache spans every batch and, with workers, lives in another process
+        with self._lock:
+            png_bytes = self._entries.get(key)
+            if png_bytes is not None:
+                self._entries.move_to_end(key)
+        if png_bytes is not None:
+            count("barcode_cache_hits")
+            return png_bytes
+        count("barcode_cache_misses")
+        png_bytes = render()
+        with self._lock:
+            self._entries[key] = png_bytes
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return png_bytes
+
+@process_singleton
+def get_barcode_cache():
+    return BarcodeCache(BARCODE_CACHE_SIZE)
+
+def _render_barcode_png(symbology, code, writer_options):
+    with stage("draw.barcode.encode"):
+        barcode_obj = symbology(code, writer=ImageWriter())
+        # Options are applied on the writer (not passed to write()) to keep the
+        # rendered output identical to the previous file-based version.
+        barcode_obj.writer.set_options(writer_options)
+    # Same as barcode_obj.write(buffer), split so rasterizing and PNG
+    # encoding are timed separately
+    with stage("draw.barcode.rasterize"):
+        image = barcode_obj.render()
+    buffer = BytesIO()
+    with stage("draw.barcode.png_encode"):
+        barcode_obj.writer.write(image, buffer)
+    return buffer.getvalue()
+
+def get_barcode_png(symbology, code, writer_options):
+    key = (symbology.__name__, code, tuple(sorted(writer_options.items())))
+    return get_barcode_cache().get_or_render(
+        key, lambda: _render_barcode_png(symbology, code, writer_options)
+    )
+
+# --- VECTOR BARCODES ---
+# Alternative to the raster path: the module pattern is painted straight onto
+# the reportlab canvas as filled rectangles and the human-readable text is
+# drawn as text. The writer reuses python-barcode's own layout pass, so bars,
+# quiet zones and text land exactly where they are in the PNG once that is
+# stretched into the same placement box.
+VECTOR_BARCODE_FONT = "Helvetica"
+
+class CanvasBarcodeWriter(BaseWriter):
+    def __init__(self, c, x, y, width, height):
+        super().__init__(self._init, self._paint_module, self._paint_text, self._finish)
+        self.canvas = c
+        self.box = (x, y, width, height)
+        self.dpi = None  # accepted for option compatibility with ImageWriter
+        self._scale_x = self._scale_y = 1
+
+    def _init(self, code):
+        width_mm, height_mm = self.calculate_size(len(code[0]), 1)
+        _, _, box_width, box_height = self.box
+        self._scale_x = box_width / (width_mm * mm)
+        self._scale_y = box_height / (height_mm * mm)
+        self.canvas.saveState()
+        self.canvas.setFillColorRGB(0, 0, 0)
+
+    def _to_canvas(self, xpos, ypos):
+        x, y, _, box_height = self.box
+        return x + xpos * mm * self._scale_x, y + box_height - ypos * mm * self._scale_y
+
+    def _paint_module(self, xpos, ypos, width, color):
+        if color != self.foreground:
+            return
+        left, bottom = self._to_canvas(xpos, ypos + self.module_height)
+        self.canvas.rect(
+            left, bottom,
+            width * mm * self._scale_x, self.module_height * mm * self._scale_y,
+            stroke=0, fill=1
+        )
+
+    def _paint_text(self, xpos, ypos):
+        font_size = self.font_size * self._scale_y
+        if font_size <= 0:
+            return
+        # The raster text gets stretched along with the image; mirror that
+        horiz_scale = self._scale_x / self._scale_y
+        # ImageWriter anchors text on its descender line; shift to the baseline
+        descent = -pdfmetrics.getDescent(VECTOR_BARCODE_FONT, font_size)
+        text = self.human if self.human != "" else self.text
+        for subtext in text.split("\n"):
+            x, y = self._to_canvas(xpos, ypos)
+            text_width = pdfmetrics.stringWidth(subtext, VECTOR_BARCODE_FONT, font_size) * horiz_scale
+            text_obj = self.canvas.beginText(x - text_width / 2, y + descent)
+            text_obj.setFont(VECTOR_BARCODE_FONT, font_size)
+            text_obj.setHorizScale(horiz_scale * 100)
+            text_obj.textLine(subtext)
+            self.canvas.drawText(text_obj)
+            ypos += pt2mm(self.font_size) / 2 + self.text_line_distance
+
+    def _finish(self):
+        self.canvas.restoreState()
+
+def draw_barcode(c, symbology, code, writer_options, x, y, width, height, vector=False):
+    with stage("draw.barcode"):
+        if not vector:
+            image = ImageReader(BytesIO(get_barcode_png(symbology, code, writer_options)))
+            c.drawImage(image, x, y, width=width, height=height)
+            return
+        barcode_obj = symbology(code, writer=CanvasBarcodeWriter(c, x, y, width, height))
+        # Same option handling as the raster path so geometry matches one to one
+        barcode_obj.writer.set_options(writer_options)
+        barcode_obj.render()
+
+# --- LABEL LAYOUTS ---
+# Each label format is a declarative spec in millimetres. compile_layout()
+# turns a spec into a LabelPlan once per process: coordinates are converted to
+# points, static shapes are grouped so they can be emitted as form XObjects,
+# and text measurements are memoized per string. Drawing a label then only
+# fills in the variable fields, and a new size is a new spec rather than a new
+# drawing function. Elements are drawn in order, barcode first, so an invalid
+# code fails before anything is on the page.
+QUANTITY_COLUMN = "Quantity"
+BARCODE_SYMBOLOGIES = {"EAN13": EAN13, "Code128": Code128}
+
+LABEL_LAYOUTS = {
+    "d2c_60x35": {
+        "page_size_mm": (60, 35),
+        "fields": ["sku", "upc", "lot"],
+        "elements": [
+            {"type": "barcode", "field": "upc", "symbology": "EAN13", "writer_options": D2C_WRITER_OPTIONS, "box_mm": (4.25, 9.5, 51.5, 16)},
+            {"type": "text", "field": "sku", "font": ("Helvetica", 9.5), "at_mm": (30, 27.25), "align": "center"},
+            {"type": "rect", "when": "lot", "rect_mm": (10, 3.625, 40, 4)},
+            {"type": "text", "field": "lot", "font": ("Helvetica", 9), "at_mm": (30, 4.75), "align": "center"},
+        ],
+    },
+    "fnsku_60x35": {
+        "page_size_mm": (60, 35),
+        "fields": ["fnsku", "product_name", "lot"],
+        "elements": [
+            {"type": "barcode", "field": "fnsku", "symbology": "Code128", "writer_options": FNSKU_WRITER_OPTIONS, "box_mm": (4.5, 10, 51.5, 16)},
+            {
+                "type": "wrapped_text", "field": "product_name", "font": ("Helvetica", 9), "at_mm": (5, 7.75),
+                "line_height_pt": 7.5, "wrap_chars": 25, "max_lines": 2, "truncate_over": 44, "keep_chars": 20,
+            },
+            {"type": "text", "field": "lot", "format": "Lot: {}", "font": ("Helvetica", 9), "at_mm": (5, 3.5)},
+        ],
+    },
+    "d2c_50x25": {
+        "page_size_mm": (50, 25),
+        "fields": ["sku", "upc", "lot"],
+        "elements": [
+            {"type": "barcode", "field": "upc", "symbology": "EAN13", "writer_options": D2C_WRITER_OPTIONS, "box_mm": (4, 6.5, 42, 12.5)},
+            {"type": "text", "field": "sku", "font": ("Helvetica", 8), "at_mm": (25, 21), "align": "center"},
+            {"type": "rect", "when": "lot", "rect_mm": (7.5, 1.6, 35, 3.6)},
+            {"type": "text", "field": "lot", "font": ("Helvetica", 8), "at_mm": (25, 2.6), "align": "center"},
+        ],
+    },
+    "fnsku_50x25": {
+        "page_size_mm": (50, 25),
+        "fields": ["fnsku", "product_name", "lot"],
+        "elements": [
+            {"type": "barcode", "field": "fnsku", "symbology": "Code128", "writer_options": FNSKU_WRITER_OPTIONS, "box_mm": (3.5, 8.5, 43, 13.5)},
+            {
+                "type": "wrapped_text", "field": "product_name", "font": ("Helvetica", 7), "at_mm": (4, 5.2),
+                "line_height_pt": 7, "wrap_chars": 34, "max_lines": 1, "truncate_over": 34, "keep_chars": 15,
+            },
+            {"type": "text", "field": "lot", "format": "Lot: {}", "font": ("Helvetica", 7), "at_mm": (4, 1.8)},
+        ],
+    },
+}
+DEFAULT_LAYOUTS = {"d2c": "d2c_60x35", "fnsku": "fnsku_60x35"}
+
+def layouts_for(kind):
+    return [name for name in LABEL_LAYOUTS if name.startswith(f"{kind}_")]
+
+@lru_cache(maxsize=8192)
+def _string_width(text, font_name, font_size):
+    return pdfmetrics.stringWidth(text, font_name, font_size)
+
+@lru_cache(maxsize=8192)
+def _fit_lines(text, wrap_chars, max_lines, truncate_over, keep_chars):
+    if len(text) > truncate_over:
+        text = text[:keep_chars] + '...' + text[-keep_chars:]
+    return tuple(textwrap.wrap(text, width=wrap_chars)[:max_lines])
+
+class LabelPlan:
+    def __init__(self, name, spec):
+        self.name = name
+        width_mm, height_mm = spec["page_size_mm"]
+        self.page_size = (width_mm * mm, height_mm * mm)
+        self.fields = tuple(spec["fields"])
+        self.steps = []
+        shape_groups = {}
+        for element in spec["elements"]:
+            field = self.fields.index(element["field"]) if "field" in element else None
+            if element["type"] == "barcode":
+                box = tuple(v * mm for v in element["box_mm"])
+                self.steps.append(("barcode", field, BARCODE_SYMBOLOGIES[element["symbology"]], element["writer_options"], box))
+            elif element["type"] == "text":
+                font_name, font_size = element["font"]
+                x, y = (v * mm for v in element["at_mm"])
+                self.steps.append((
+                    "text", field, element.get("format"), font_name, font_size, x, y,
+                    element.get("align", "left")
+                ))
+            elif element["type"] == "wrapped_text":
+                font_name, font_size = element["font"]
+                x, y = (v * mm for v in element["at_mm"])
+                fit = (element["wrap_chars"], element["max_lines"], element["truncate_over"], element["keep_chars"])
+                self.steps.append(("wrapped_text", field, font_name, font_size, x, y, element["line_height_pt"], fit))
+            elif element["type"] == "rect":
+                # Rects sharing a condition become one static group (one form)
+                when = self.fields.index(element["when"]) if "when" in element else None
+                rect = tuple(v * mm for v in element["rect_mm"])
+                if when not in shape_groups:
+                    shape_groups[when] = [rect]
+                    form_name = f"{name}_static_{element.get('when', 'always')}"
+                    self.steps.append(("shapes", when, form_name, shape_groups[when]))
+                else:
+                    shape_groups[when].append(rect)
+            else:
+                raise ValueError(f"Unknown layout element type: {element['type']}")
+
+    @staticmethod
+    def _draw_shapes(c, rects):
+        c.setStrokeColorRGB(0, 0, 0)
+        for rect in rects:
+            c.rect(*rect, stroke=1, fill=0)
+
+    def define_forms(self, c):
+        """Emit the static shape groups once as form XObjects on this canvas."""
+        for step in self.steps:
+            if step[0] == "shapes":
+                _, _, form_name, rects = step
+                c.beginForm(form_name)
+                self._draw_shapes(c, rects)
+                c.endForm()
+
+    def draw(self, c, values, vector_barcodes=False, use_forms=False):
+        """values are in self.fields order. use_forms requires define_forms(c) first."""
+        for step in self.steps:
+            step_type = step[0]
+            if step_type == "barcode":
+                _, field, symbology, writer_options, box = step
+                draw_barcode(c, symbology, values[field], writer_options, *box, vector=vector_barcodes)
+            elif step_type == "text":
+                _, field, text_format, font_name, font_size, x, y, align = step
+                value = values[field]
+                if not value:
+                    continue
+                text = text_format.format(value) if text_format else str(value)
+                if align == "center":
+                    x -= _string_width(text, font_name, font_size) / 2
+                c.setFont(font_name, font_size)
+                c.drawString(x, y, text)
+            elif step_type == "wrapped_text":
+                _, field, font_name, font_size, x, y, line_height, fit = step
+                value = values[field]
+                if not value:
+                    continue
+                c.setFont(font_name, font_size)
+                for i, line in enumerate(_fit_lines(str(value), *fit)):
+                    c.drawString(x, y - i * line_height, line)
+            elif step_type == "shapes":
+                _, when, form_name, rects = step
+                if when is not None and not values[when]:
+                    continue
+                if use_forms:
+                    c.doForm(form_name)
+                else:
+                    self._draw_shapes(c, rects)
+
+@lru_cache(maxsize=None)
+def compile_layout(name):
+    if name not in LABEL_LAYOUTS:
+        raise ValueError(f"Unknown label layout: {name}")
+    return LabelPlan(name, LABEL_LAYOUTS[name])
+
+# --- PERSISTENT LABEL CACHE ---
+# Single-label PDFs are stored on disk under a content hash of the input fields
+# plus a layout fingerprint, so relabelling the same SKU/UPC/LOT is a file copy.
+# Bump LABEL_LAYOUT_VERSION whenever a drawing change should invalidate
+# existing entries; library versions and the layout specs are folded in already.
+# The cache's size is kept as a running total rather than walked on demand:
+# writes report what they added as chunk counters (workers write from other
+# processes), the batch folds those in, and only a total over budget walks the
+# directory to evict. The total is re-synced from disk every
+# LABEL_CACHE_RESCAN_SECONDS to pick up other processes (e.g. the CLI).
+LABEL_LAYOUT_VERSION = 1
+LABEL_CACHE_DIR = os.environ.get("LABEL_CACHE_DIR", os.path.join(gettempdir(), "tos_hub_label_cache"))
+LABEL_CACHE_MAX_BYTES = int(os.environ.get("LABEL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+LABEL_CACHE_RESCAN_SECONDS = 10 * 60
+
+def layout_fingerprint():
+    return json.dumps([
+        LABEL_LAYOUT_VERSION,
+        LABEL_LAYOUTS,
+        VECTOR_BARCODE_FONT,
+        reportlab.Version,
+        barcode.version,
+    ], sort_keys=True)
+
+class LabelCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._fingerprint = layout_fingerprint()
+        self._lock = threading.Lock()
+        self._files = self._bytes = 0
+        self._scanned_at = None  # no running total until the first scan
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, layout, args, vector_barcodes):
+        payload = json.dumps([layout, [str(arg) for arg in args], vector_barcodes, self._fingerprint])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pdf_bytes = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # mtime doubles as last-used time for eviction
+        except OSError:
+            pass
+        return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        """Store an entry. What it added is counted as label_cache_files/bytes_added."""
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write-then-rename so concurrent workers never see a partial file
+            fd, tmp_path = mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, path)
+        except OSError:
+            return  # the cache is best effort; rendering already succeeded
+        count("label_cache_files_added", 1 if replaced is None else 0)
+        count("label_cache_bytes_added", len(pdf_bytes) - (replaced or 0))
+
+    def record_added(self, files, size):
+        """Fold entries written by put() (in any process) into the running total."""
+        with self._lock:
+            self._files += files
+            self._bytes += size
+
+    def _entries(self):
+        entries = []
+        for folder_name, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(folder_name, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _set_total(self, files, size):
+        with self._lock:
+            self._files, self._bytes = files, size
+            self._scanned_at = time.monotonic()
+
+    def _rescan(self):
+        entries = self._entries()
+        self._set_total(len(entries), sum(size for _, size, _ in entries))
+        return entries
+
+    def _total_is_stale(self):
+        return self._scanned_at is None or time.monotonic() - self._scanned_at > LABEL_CACHE_RESCAN_SECONDS
+
+    def usage(self, rescan=False):
+        """{"files", "bytes", "max_bytes"}; walks the directory only when rescan or stale."""
+        if rescan or self._total_is_stale():
+            self._rescan()
+        with self._lock:
+            return {"files": self._files, "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def evict(self):
+        # Nothing to do while the running total is within budget
+        if self.usage()["bytes"] <= self.max_bytes:
+            return
+        # Least recently used first until the cache fits its size budget
+        entries = sorted(self._rescan())
+        files, total = len(entries), sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                files -= 1
+                total -= size
+            except OSError:
+                pass
+        self._set_total(files, total)
+
+    def purge(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self._set_total(0, 0)
+
+label_cache = LabelCache(LABEL_CACHE_DIR, LABEL_CACHE_MAX_BYTES)
+
+def render_label_file(layout, args, vector_barcodes=False, use_cache=True):
+    """Returns (pdf_bytes, cache_hit) for a single-label PDF."""
+    use_cache = use_cache and label_cache.enabled
+    if use_cache:
+        key = label_cache.key(layout, args, vector_barcodes)
+        with stage("label_cache.read"):
+            cached = label_cache.get(key)
+        if cached is not None:
+            return cached, True
+    plan = compile_layout(layout)
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=plan.page_size)
+    with stage("draw"):
+        plan.draw(c, args, vector_barcodes=vector_barcodes)
+    with stage("pdf_serialize"):
+        c.showPage()
+        c.save()
+    pdf_bytes = buffer.getvalue()
+    if use_cache:
+        with stage("label_cache.write"):
+            label_cache.put(key, pdf_bytes)
+    return pdf_bytes, False
+
+# --- MULTI-PAGE PDF OUTPUT ---
+# One canvas for the whole batch: fonts and static shapes are emitted once, and
+# rows with a quantity above one are captured as a form XObject so every copy
+# is just a reference to the same content instead of a re-render.
+
+def add_label_pages(c, form_name, copies, draw_label, *args, **kwargs):
+    if copies == 1:
+        with stage("draw"):
+            draw_label(c, *args, **kwargs)
+        c.showPage()
+        return
+    c.beginForm(form_name)
+    try:
+        with stage("draw"):
+            draw_label(c, *args, **kwargs)
+    finally:
+        c.endForm()
+    for _ in range(copies):
+        c.doForm(form_name)
+        c.showPage()
+
+
+# --- ZPL OUTPUT ---
+# For Zebra thermal printers: each layout spec is compiled once into stored
+# label formats (^DF) holding everything static, barcodes as printer-native
+# ^BE (EAN13) / ^BC (Code128) fields, so the printer draws the bars itself.
+# Every label is then just a recall (^XF) with its field data (^FN) and a
+# copy count (^PQ). Conditional shapes (the lot box) get their own format
+# variant instead of per-label drawing commands. Barcode placement and module
+# width come from the same python-barcode layout pass the PDFs use, rounded
+# to whole printer dots. Recalls name the format without device and extension
+# (R: and .ZPL are ^XF's defaults); what remains per label is mostly framing
+# (^XA, ^FN/^FD/^FS per field, ^XZ) around the field data itself, about 70-100
+# bytes for a 60x35 label.
+ZPL_DOTS_PER_MM = int(os.environ.get("ZPL_DOTS_PER_MM", 8))  # 8 = 203 dpi, 12 = 300 dpi
+ZPL_FONT_BASELINE = 0.8  # font 0 baseline, as a fraction of the character height
+ZPL_FIELD_ESCAPES = {"_": "_5F", "^": "_5E", "~": "_7E"}
+# Representative codes for sizing: EAN13 is fixed width, Code128 width follows
+# the data, so FNSKU barcodes are sized (and centered) for a typical FNSKU
+ZPL_SAMPLE_CODES = {"EAN13": "0000000000000", "Code128": "X00ABCDEFG"}
+
+class _RectRecorder(canvas.Canvas):
+    def __init__(self):
+        super().__init__(BytesIO())
+        self.rects = []
+
+    def rect(self, x, y, width, height, stroke=1, fill=0):
+        self.rects.append((x, y, width, height))
+
+def _zpl_block_text(lines):
+    # Inside a field block (^FB) \& breaks the line and \\ is a literal backslash
+    return "\\&".join(line.replace("\\", "\\\\") for line in lines)
+
+def _zpl_field_data(value):
+    text = str(value)
+    if not any(char in text for char in ZPL_FIELD_ESCAPES):
+        return f"^FD{text}"
+    return "^FH^FD" + "".join(ZPL_FIELD_ESCAPES.get(char, char) for char in text)
+
+class ZplPlan:
+    def __init__(self, name, spec, dots_per_mm):
+        self.name = name
+        self.fields = tuple(spec["fields"])
+        width_mm, height_mm = spec["page_size_mm"]
+        self._dots_per_mm = dots_per_mm
+        self._height_mm = height_mm
+        kind, size = name.split("_", 1)
+        # ZPL object names are limited to 8 characters on older firmware
+        prefix = f"{kind[0].upper()}{size.replace('x', '')}"[:7]
+        self.steps = []  # (field, value transform), in ^FN order
+        static, conditional = [], {}
+        for element in spec["elements"]:
+            field = self.fields.index(element["field"]) if "field" in element else None
+            number = len(self.steps) + 1
+            if element["type"] == "barcode":
+                static.append(self._barcode(element, number))
+                symbology = element["symbology"]
+                # ^BE computes the EAN13 check digit itself from the first 12
+                self.steps.append((field, (lambda code: code[:12]) if symbology == "EAN13" else str))
+            elif element["type"] == "text":
+                font_size = element["font"][1]
+                x_mm, y_mm = element["at_mm"]
+                if element.get("align") == "center":
+                    half_width = min(x_mm, width_mm - x_mm)
+                    left_mm, block_mm, justify = x_mm - half_width, 2 * half_width, "C"
+                else:
+                    left_mm, block_mm, justify = x_mm, width_mm - 2 * x_mm, "L"
+                static.append(self._text(left_mm, y_mm, font_size, block_mm, 1, 0, justify, number))
+                text_format = element.get("format") or "{}"
+                self.steps.append((field, lambda value, f=text_format: _zpl_block_text([f.format(value)]) if value else ""))
+            elif element["type"] == "wrapped_text":
+                font_size = element["font"][1]
+                x_mm, y_mm = element["at_mm"]
+                char_height = self._font_dots(font_size)
+                spacing = round(element["line_height_pt"] / 72 * 25.4 * dots_per_mm) - char_height
+                static.append(self._text(x_mm, y_mm, font_size, width_mm - 2 * x_mm, element["max_lines"], spacing, "L", number))
+                fit = (element["wrap_chars"], element["max_lines"], element["truncate_over"], element["keep_chars"])
+                # Same line breaks as the PDF
+                self.steps.append((field, lambda value, fit=fit: _zpl_block_text(_fit_lines(str(value), *fit)) if value else ""))
+            elif element["type"] == "rect":
+                x_mm, y_mm, w_mm, h_mm = element["rect_mm"]
+                thickness = max(1, round(1 / 72 * 25.4 * dots_per_mm))  # the PDF's default 1 pt line
+                command = (
+                    f"^FO{self._dots(x_mm)},{self._dots(height_mm - y_mm - h_mm)}"
+                    f"^GB{self._dots(w_mm)},{self._dots(h_mm)},{thickness}^FS"
+                )
+                if "when" in element:
+                    conditional.setdefault(self.fields.index(element["when"]), []).append(command)
+                else:
+                    static.append(command)
+            else:
+                raise ValueError(f"Unknown layout element type: {element['type']}")
+        # One stored format per combination of present conditional fields
+        self._conditions = sorted(conditional)
+        self.formats = {}
+        for variant in range(2 ** len(self._conditions)):
+            commands = list(static)
+            for bit, when in enumerate(self._conditions):
+                if variant & (1 << bit):
+                    commands += conditional[when]
+            format_name = f"{prefix}{variant}"
+            self.formats[variant] = (format_name, (
+                f"^XA^DFR:{format_name}.ZPL^FS^CI28^PW{self._dots(width_mm)}^LL{self._dots(height_mm)}^LH0,0"
+                + "".join(commands) + "^XZ\n"
+            ))
+
+    def _dots(self, millimetres):
+        return round(millimetres * self._dots_per_mm)
+
+    def _font_dots(self, font_size):
+        return round(font_size / 72 * 25.4 * self._dots_per_mm)
+
+    def _text(self, left_mm, baseline_mm, font_size, block_mm, lines, spacing, justify, number):
+        char_height = self._font_dots(font_size)
+        top = self._dots(self._height_mm - baseline_mm) - round(char_height * ZPL_FONT_BASELINE)
+        return (
+            f"^FO{self._dots(left_mm)},{max(0, top)}^A0N,{char_height},{char_height}"
+            f"^FB{self._dots(block_mm)},{lines},{spacing},{justify},0^FN{number}^FS"
+        )
+
+    def _barcode(self, element, number):
+        symbology = element["symbology"]
+        recorder = _RectRecorder()
+        box = [v * mm for v in element["box_mm"]]
+        draw_barcode(
+            recorder, BARCODE_SYMBOLOGIES[symbology], ZPL_SAMPLE_CODES[symbology],
+            element["writer_options"], *box, vector=True
+        )
+        rects = recorder.rects
+        left = min(x for x, _, _, _ in rects)
+        right = max(x + w for x, _, w, _ in rects)
+        top = max(y + h for _, y, _, h in rects)
+        bottom = max(y for _, y, _, _ in rects)  # regular bars; EAN guard bars reach lower
+        module_width = min(w for _, _, w, _ in rects)
+        modules = round((right - left) / module_width)
+        module_dots = max(1, int((right - left) / mm * self._dots_per_mm / modules))
+        center = self._dots((left + right) / 2 / mm)
+        x = max(0, center - modules * module_dots // 2)
+        y = self._dots(self._height_mm - top / mm)
+        height = self._dots((top - bottom) / mm)
+        command = f"^BEN,{height},Y,N" if symbology == "EAN13" else f"^BCN,{height},Y,N,N,A"
+        return f"^FO{x},{y}^BY{module_dots}{command}^FN{number}^FS"
+
+    def header(self):
+        """The stored formats, sent once ahead of the labels."""
+        return "".join(zpl for _, zpl in self.formats.values())
+
+    def label(self, values, copies=1):
+        """One label recall; values are in self.fields order."""
+        variant = sum(1 << bit for bit, when in enumerate(self._conditions) if values[when])
+        data = ""
+        for number, (field, transform) in enumerate(self.steps, start=1):
+            value = transform(values[field])
+            if value:  # an unset field prints nothing
+                data += f"^FN{number}{_zpl_field_data(value)}^FS"
+        quantity = f"^PQ{copies}" if copies > 1 else ""
+        return f"^XA^XF{self.formats[variant][0]}^FS{data}{quantity}^XZ\n"
+
+@lru_cache(maxsize=None)
+def compile_zpl_layout(name, dots_per_mm=ZPL_DOTS_PER_MM):
+    if name not in LABEL_LAYOUTS:
+        raise ValueError(f"Unknown label layout: {name}")
+    return ZplPlan(name, LABEL_LAYOUTS[name], dots_per_mm)
+
+def label_zpl(layout, args, copies=1, dots_per_mm=ZPL_DOTS_PER_MM):
+    """A self-contained ZPL job (formats + one label) for a single label."""
+    plan = compile_zpl_layout(layout, dots_per_mm)
+    return plan.header() + plan.label(args, copies)
+
+# --- ROW NORMALIZATION & VALIDATION ---
+# One vectorized pass over the whole upload before anything is rendered:
+# identifiers are normalized (Excel likes to turn UPCs into floats or
+# scientific notation), check digits and FNSKU format are validated, NaNs are
+# resolved and output filenames are de-duplicated. Every bad row is reported
+# at once as (excel_row, message); the good ones come back as compact tuples
+# (excel_row, pdf_filename, draw_args, copies) ready for the render loop.
+D2C_REQUIRED_COLUMNS = ['SKU', 'UPC Code', 'LOT#']
+FNSKU_REQUIRED_COLUMNS = ['FNSKU', 'Product Name', 'LOT#']
+FNSKU_PATTERN = r'[A-Z0-9]{10}'
+EXCEL_FLOAT_PATTERN = r'\d+\.0*'
+EXCEL_SCIENTIFIC_PATTERN = r'\d+(\.\d+)?[eE]\+?\d+'
+
+def label_upload_columns(kind):
+    """(columns to read, identifier columns to read as text) for a label upload."""
+    required = D2C_REQUIRED_COLUMNS if kind == "d2c" else FNSKU_REQUIRED_COLUMNS
+    return required + [QUANTITY_COLUMN], required
+
+def _require_columns(df, columns):
+    missing_columns = [col for col in columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns in the Excel file: {', '.join(missing_columns)}")
+
+def _text_column(series):
+    """Strip, turn NaN into "" and undo Excel's float rendering of integers ("123.0")."""
+    text = series.astype("string").str.strip().fillna("")
+    float_like = text.str.fullmatch(EXCEL_FLOAT_PATTERN)
+    if float_like.any():
+        text[float_like] = text[float_like].str.replace(r'\.0*$', '', regex=True)
+    return text
+
+def _scientific_to_digits(text):
+    numbers = pd.to_numeric(text, errors='coerce')
+    return numbers.round().astype("Int64").astype("string").fillna(text)
+
+def _scientific_lost_digits(text, digits):
+    """
+    text: Series of scientific-notation strings, digits: the integers they
+    stand for. True where the mantissa has fewer significant digits than the
+    integer (Excel's "1.23457E+11"), whatever the check digit says.
+    """
+    mantissa = text.str.extract(r'^([\d.]+)', expand=False).str.replace(".", "", regex=False).str.lstrip("0")
+    return mantissa.str.len() < digits.str.lstrip("0").str.len()
+
+def _ean13_check_digit_ok(codes):
+    """codes: Series of 13-digit strings."""
+    if codes.empty:
+        return pd.Series(True, index=codes.index)
+    digits = np.frombuffer("".join(codes).encode("ascii"), dtype=np.uint8).reshape(-1, 13) - ord("0")
+    weights = np.array([1, 3] * 6)
+    expected = (10 - (digits[:, :12] @ weights) % 10) % 10
+    return pd.Series(expected == digits[:, 12], index=codes.index)
+
+def _label_copies(df):
+    if QUANTITY_COLUMN not in df.columns:
+        return pd.Series(1, index=df.index)
+    qty = pd.to_numeric(df[QUANTITY_COLUMN], errors='coerce').fillna(1)
+    return qty.clip(lower=1).astype(int)
+
+def _dedupe_filenames(names, extension):
+    # "A.pdf", "A.pdf" -> "A.pdf", "A_2.pdf"
+    occurrence = names.groupby(names).cumcount()
+    stems = names.str.slice(stop=-len(extension))
+    return names.where(occurrence == 0, stems + "_" + (occurrence + 1).astype("string") + extension)
+
+def _split_rows(df, errors, filenames, args_columns):
+    excel_rows = pd.Series(np.arange(len(df)) + 2, index=df.index)
+    valid = errors == ""
+    copies = _label_copies(df)
+    rows = list(zip(
+        excel_rows[valid].tolist(),
+        filenames[valid].tolist(),
+        zip(*(column[valid].tolist() for column in args_columns)),
+        copies[valid].tolist(),
+    ))
+    invalid_rows = list(zip(excel_rows[~valid].tolist(), errors[~valid].tolist()))
+    return rows, invalid_rows
+
+def prepare_d2c_rows(df):
+    """Returns (rows, invalid_rows). Raises ValueError on missing columns."""
+    _require_columns(df, D2C_REQUIRED_COLUMNS)
+    sku = _text_column(df['SKU'])
+    lot = _text_column(df['LOT#'])
+    upc = _text_column(df['UPC Code'])
+    missing_upc = upc == ""
+    scientific = upc.str.fullmatch(EXCEL_SCIENTIFIC_PATTERN)
+    lost_digits = pd.Series(False, index=df.index)
+    if scientific.any():
+        digits = _scientific_to_digits(upc[scientific])
+        lost_digits[scientific] = _scientific_lost_digits(upc[scientific], digits)
+        upc[scientific] = digits
+    upc = upc.str.zfill(12)
+    upc = upc.where(upc.str.len() != 12, "0" + upc)
+    well_formed = upc.str.fullmatch(r'\d{13}')
+    check_ok = pd.Series(True, index=df.index)
+    check_ok[well_formed] = _ean13_check_digit_ok(upc[well_formed])
+    errors = pd.Series(np.select(
+        [sku == "", missing_upc, lost_digits, ~well_formed, ~check_ok],
+        [
+            "Missing SKU",
+            "Missing UPC Code",
+            "UPC Code was stored in scientific notation and lost digits",
+            "UPC Code must be up to 13 digits",
+            "Invalid UPC/EAN check digit",
+        ],
+        default="",
+    ), index=df.index)
+    filenames = _dedupe_filenames(sku.str.replace(INVALID_FILENAME_CHARS, '', regex=True) + ".pdf", ".pdf")
+    return _split_rows(df, errors, filenames, (sku, upc, lot))
+
+def prepare_fnsku_rows(df):
+    """Returns (rows, invalid_rows). Raises ValueError on missing columns."""
+    _require_columns(df, FNSKU_REQUIRED_COLUMNS)
+    fnsku = _text_column(df['FNSKU']).str.upper()
+    product_name = df['Product Name'].astype("string").fillna("")
+    lot = _text_column(df['LOT#'])
+    errors = pd.Series(np.select(
+        [fnsku == "", ~fnsku.str.fullmatch(FNSKU_PATTERN)],
+        ["Missing FNSKU", "FNSKU must be 10 letters/digits"],
+        default="",
+    ), index=df.index)
+    filenames = _dedupe_filenames(fnsku + "_fnsku_label.pdf", ".pdf")
+    return _split_rows(df, errors, filenames, (fnsku, product_name, lot))
+
+# --- BATCH RENDERING ---
+# Prepared rows are plain tuples, so they can be shipped to worker processes
+# as they are. Rendering happens in
+# contiguous chunks; results are put back together in row order, so output
+# order and filenames do not depend on which worker finished first. A row that
+# fails is recorded as (excel_row, message) and the rest of the batch carries on.
+MAX_CHUNK_ROWS = 250
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+def _render_chunk(rows, options, on_row=None):
+    """
+    Render a chunk of label rows. Returns (output, errors, stats) where output
+    is the bytes of one multi-page PDF when options["single_pdf"] is set (None
+    if no page was produced), otherwise a list of (filename, pdf_bytes). stats
+    carries this chunk's label and barcode cache counters and stage timings.
+    """
+    chunk = Instrumentation()
+    with recording(chunk), stage("render_chunk", sample=True):
+        output, errors = _render_chunk_rows(rows, options, chunk.counters, on_row)
+    return output, errors, chunk.to_stats()
+
+def _render_chunk_rows(rows, options, stats, on_row):
+    layout = options["layout"]
+    plan = compile_layout(layout)
+    vector_barcodes = options["vector_barcodes"]
+    single_pdf = options["single_pdf"]
+    errors = []
+    if single_pdf:
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=plan.page_size)
+        plan.define_forms(c)
+    else:
+        files = []
+    pages = 0
+    for excel_row, filename, args, copies in rows:
+        try:
+            if single_pdf:
+                add_label_pages(
+                    c, f"label_{excel_row}", copies, plan.draw, args,
+                    vector_barcodes=vector_barcodes, use_forms=True
+                )
+                pages += copies
+            else:
+                pdf_bytes, cache_hit = render_label_file(layout, args, vector_barcodes, use_cache=options["use_cache"])
+                files.append((filename, pdf_bytes))
+                stats["label_cache_hits" if cache_hit else "label_cache_misses"] += 1
+            stats["labels_rendered"] += 1
+        except Exception as e:
+            errors.append((excel_row, str(e)))
+        if on_row:
+            on_row()
+    if not single_pdf:
+        return files, errors
+    if not pages:
+        return None, errors
+    with stage("pdf_serialize"):
+        c.save()
+    return buffer.getvalue(), errors
+
+def _get_pool():
+    # One pool sized to the machine, shared by concurrent batches; a batch's
+    # `workers` only limits how many of its chunks are in flight. Resizing a
+    # pool another batch is still submitting to would break that batch.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the Streamlit server is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=default_worker_count(), mp_context=get_context("spawn"))
+        return _pool
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def shutdown_pool():
+    """
+    Stop the render pool's worker processes. Only needed when the caller is
+    itself a multiprocessing child: its exit joins child processes before any
+    executor cleanup runs, so live pool workers would hang it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+def _iter_parallel(chunks, options, workers, on_chunk):
+    # Chunks are yielded strictly in order, with at most `workers` in flight,
+    # so finished output never piles up waiting for a slow chunk and a batch
+    # never takes more of the shared pool than it asked for
+    pool = _get_pool()
+    pending = {}
+    next_submit = 0
+    try:
+        for i in range(len(chunks)):
+            while next_submit < len(chunks) and next_submit < i + workers:
+                pending[next_submit] = pool.submit(_render_chunk, chunks[next_submit], options)
+                next_submit += 1
+            result = pending.pop(i).result()
+            on_chunk(len(chunks[i]))
+            yield result
+    finally:
+        # Abandoned (e.g. cancelled) batch: don't leave queued chunks behind
+        for future in pending.values():
+            future.cancel()
+
+def iter_rendered_chunks(rows, options, workers=1, progress_callback=None):
+    """
+    Render prepared label rows and yield (output, errors, stats) per chunk, in
+    row order. Uses the process pool when workers > 1 and falls back to
+    rendering in this process if the pool is unavailable.
+    """
+    done_rows = [0]
+
+    def advance(count):
+        done_rows[0] += count
+        if progress_callback:
+            progress_callback(done_rows[0] / len(rows))
+
+    done_chunks = 0
+    if workers > 1 and len(rows) > 1:
+        # Several chunks per worker keeps progress updates flowing and the load even
+        size = max(1, min(MAX_CHUNK_ROWS, -(-len(rows) // (workers * 4))))
+        chunks = chunked(rows, size)
+        try:
+            for result in _iter_parallel(chunks, options, workers, advance):
+                done_chunks += 1
+                yield result
+            return
+        except (BrokenProcessPool, OSError):
+            # Pool could not start or a worker died: finish the batch serially
+            _discard_pool()
+    else:
+        # A single canvas for the whole PDF; ZIP entries are streamed per chunk
+        chunks = [rows] if options["single_pdf"] else chunked(rows, MAX_CHUNK_ROWS)
+    for chunk in chunks[done_chunks:]:
+        yield _render_chunk(chunk, options, on_row=lambda: advance(1))
+
+def _zpl_chunk(rows, options):
+    chunk = Instrumentation()
+    with recording(chunk), stage("zpl_format"):
+        plan = compile_zpl_layout(options["layout"])
+        zpl = "".join(plan.label(args, copies) for _, _, args, copies in rows)
+    chunk.counters["labels_rendered"] += len(rows)
+    return zpl.encode("utf-8"), [], chunk.to_stats()
+
+def iter_zpl_chunks(rows, options, progress_callback=None):
+    """Same shape as iter_rendered_chunks; ZPL is plain text, so no worker pool."""
+    done_rows = 0
+    for chunk in chunked(rows, MAX_CHUNK_ROWS):
+        yield _zpl_chunk(chunk, options)
+        done_rows += len(chunk)
+        if progress_callback:
+            progress_callback(done_rows / len(rows))
+
+def _report_errors(errors, row_errors, error_callback):
+    row_errors.extend(errors)
+    if error_callback:
+        for excel_row, message in errors:
+            error_callback(excel_row, message)
+
+def _write_label_output(chunks, output, destination, options, row_errors, error_callback, batch):
+    """Drain the rendered chunks into output (or the destination directory). Returns the labels written."""
+    labels_written = 0
+    if options["output_format"] == "zpl":
+        output.write(compile_zpl_layout(options["layout"]).header().encode("utf-8"))
+        for zpl, errors, chunk_stats in chunks:
+            _report_errors(errors, row_errors, error_callback)
+            batch.merge_stats(chunk_stats)
+            with stage("zpl_write"):
+                output.write(zpl)
+            labels_written += chunk_stats["labels_rendered"]
+        return labels_written
+    if options["output_format"] == "pdf":
+        chunk_pdfs = []
+        for chunk_pdf, errors, chunk_stats in chunks:
+            _report_errors(errors, row_errors, error_callback)
+            batch.merge_stats(chunk_stats)
+            if chunk_pdf:
+                chunk_pdfs.append(chunk_pdf)
+        with stage("pdf_merge", sample=True):
+            if len(chunk_pdfs) == 1:
+                output.write(chunk_pdfs[0])
+            elif chunk_pdfs:
+                # Only parallel single-PDF batches merge; keep PyPDF2 off the import path
+                from PyPDF2 import PdfReader, PdfWriter
+                writer = PdfWriter()
+                for chunk_pdf in chunk_pdfs:
+                    writer.append(PdfReader(BytesIO(chunk_pdf)))
+                writer.write(output)
+        return len(chunk_pdfs)
+    seen = set()
+    zip_file = ZipFile(output, 'w') if output is not None else None
+    try:
+        for files, errors, chunk_stats in chunks:
+            _report_errors(errors, row_errors, error_callback)
+            batch.merge_stats(chunk_stats)
+            with stage("zip_write" if zip_file else "file_write", sample=True):
+                for label_filename, pdf_bytes in files:
+                    label_filename = unique_name(label_filename, seen)
+                    if zip_file:
+                        zip_file.writestr(label_filename, pdf_bytes)
+                    else:
+                        with open(os.path.join(destination, label_filename), "wb") as f:
+                            f.write(pdf_bytes)
+                        batch.counters["output_bytes"] += len(pdf_bytes)
+            labels_written += len(files)
+    finally:
+        if zip_file:
+            zip_file.close()
+    if options["use_cache"] and label_cache.enabled:
+        label_cache.record_added(
+            batch.counters["label_cache_files_added"], batch.counters["label_cache_bytes_added"]
+        )
+        with stage("label_cache.evict"):
+            label_cache.evict()
+    return labels_written
+
+def _write_label_batch(rows, invalid_rows, names, options, workers, progress_callback, error_callback, batch, destination=None):
+    """
+    Write the batch in options["output_format"]. "zip", "pdf" and "zpl" go to the
+    destination path or, without one, into a spooled temporary file that stays
+    in RAM up to SPOOL_MAX_BYTES and spills to a private temp file beyond that;
+    "dir" writes one PDF per label into the destination directory. Returns
+    (output, filename, row_errors): output is the rewound spooled file (None
+    when written to a destination or if no label was rendered), filename the
+    download name or the path written. row_errors starts with the rows
+    rejected by validation; error_callback(excel_row, message) hears about
+    each row error as soon as it is known. Counters and the chunks' stage
+    timings are merged into the batch Instrumentation.
+    """
+    row_errors = []
+    _report_errors(invalid_rows, row_errors, error_callback)
+    batch.counters["rows_invalid"] += len(invalid_rows)
+    if not rows:
+        return None, None, row_errors
+    if options["output_format"] == "zpl":
+        chunks = iter_zpl_chunks(rows, options, progress_callback=progress_callback)
+    else:
+        chunks = iter_rendered_chunks(rows, options, workers=workers, progress_callback=progress_callback)
+    if options["output_format"] == "dir":
+        os.makedirs(destination, exist_ok=True)
+        output = None
+    elif destination is not None:
+        output = open(destination, "wb")
+    else:
+        output = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        labels_written = _write_label_output(chunks, output, destination, options, row_errors, error_callback, batch)
+    except BaseException:
+        # Failed or cancelled: don't leave a truncated file behind
+        if output is not None:
+            output.close()
+            if destination is not None:
+                os.remove(destination)
+        raise
+    batch.counters["rows_failed"] += len(row_errors) - len(invalid_rows)
+    if output is None:
+        return None, destination if labels_written else None, row_errors
+    batch.counters["output_bytes"] += output.tell()
+    if destination is None and labels_written:
+        output.seek(0)
+        return output, names[options["output_format"]], row_errors
+    output.close()
+    if not labels_written:
+        if destination is not None:
+            os.remove(destination)
+        return None, None, row_errors
+    return None, destination, row_errors
+
+OUTPUT_FORMATS = ("zip", "pdf", "dir", "zpl")
+
+# kind -> (prepare_rows, column naming the batch, suffix of the single PDF/ZPL file's name)
+LABEL_KINDS = {
+    "d2c": (prepare_d2c_rows, 'SKU', ""),
+    "fnsku": (prepare_fnsku_rows, 'FNSKU', "_fnsku_labels"),
+}
+
+def _render_options(kind, layout, vector_barcodes, output_format, use_cache):
+    layout = layout or DEFAULT_LAYOUTS[kind]
+    if layout not in layouts_for(kind):
+        raise ValueError(f"Layout {layout} is not a {kind} layout")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Output format must be one of {', '.join(OUTPUT_FORMATS)}")
+    return {
+        "layout": layout, "vector_barcodes": vector_barcodes, "output_format": output_format,
+        "single_pdf": output_format == "pdf", "use_cache": use_cache,
+    }
+
+def generate_labels(kind, df, output_format="zip", destination=None, vector_barcodes=False, workers=1,
+                    progress_callback=None, error_callback=None, use_cache=True, layout=None):
+    """
+    Render a "d2c" or "fnsku" label batch without any UI. output_format is
+    "zip", "pdf" (one multi-page PDF), "dir" (one PDF per label, needs a
+    destination directory) or "zpl" (one ZPL job for Zebra printers). progress_callback(fraction) and
+    error_callback(excel_row, message) are called from this thread as the
+    batch advances. Returns (output, filename, row_errors, stats). Raises
+    ValueError on missing columns.
+    """
+    if output_format == "dir" and destination is None:
+        raise ValueError("Directory output needs a destination directory")
+    options = _render_options(kind, layout, vector_barcodes, output_format, use_cache)
+    prepare_rows, name_column, pdf_suffix = LABEL_KINDS[kind]
+    with recording(Instrumentation()) as batch:
+        with stage("total"):
+            with stage("validate_rows", sample=True):
+                rows, invalid_rows = prepare_rows(df)
+            first_name = df.iloc[0][name_column] if len(df) else kind
+            current_date = datetime.now().strftime("%Y%m%d")
+            output_name = clean_filename(f"{first_name}_{current_date}")
+            names = {
+                "zip": f"{output_name}.zip",
+                "pdf": f"{output_name}{pdf_suffix}.pdf",
+                "zpl": f"{output_name}{pdf_suffix}.zpl",
+            }
+            output, filename, row_errors = _write_label_batch(
+                rows, invalid_rows, names, options, workers, progress_callback, error_callback, batch,
+                destination=destination
+            )
+    return output, filename, row_errors, batch.to_stats()
+
+def generate_pdfs_from_excel(df, vector_barcodes=False, single_pdf=False, workers=1, progress_callback=None, use_cache=True, layout=None):
+    """Returns (output, filename, row_errors, stats). Raises ValueError on missing columns."""
+    return generate_labels(
+        "d2c", df, "pdf" if single_pdf else "zip", vector_barcodes=vector_barcodes, workers=workers,
+        progress_callback=progress_callback, use_cache=use_cache, layout=layout
+    )
+
+def generate_fnsku_labels_from_excel(df, vector_barcodes=False, single_pdf=False, workers=1, progress_callback=None, use_cache=True, layout=None):
+    """Returns (output, filename, row_errors, stats). Raises ValueError on missing columns."""
+    return generate_labels(
+        "fnsku", df, "pdf" if single_pdf else "zip", vector_barcodes=vector_barcodes, workers=workers,
+        progress_callback=progress_callback, use_cache=use_cache, layout=layout
+    )
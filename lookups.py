@@ -0,0 +1,345 @@
+"""
+SKU -> UPC and FNSKU -> Product Name lookups for label uploads.
+
+A batch resolves all of its missing fields at once: unique keys are looked
+up in an in-memory LRU, then in an on-disk SQLite snapshot, and only what is
+left goes to the database in one bulk query (chunked to keep request URLs
+short). Answers, including "not found", are kept for LOOKUP_TTL_SECONDS, and
+an admin bulk update invalidates the keys it touched. The database is
+Supabase when credentials are configured; otherwise a local SQLite file with
+the same tables stands in, so everything works offline. Neither the database
+connection nor any SQLite file is created until a lookup or an update needs it.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import gettempdir
+
+import pandas as pd
+
+from instrumentation import stage
+from shared import chunked, process_singleton
+
+LOOKUP_CACHE_SIZE = int(os.environ.get("LOOKUP_CACHE_SIZE", 200_000))
+LOOKUP_TTL_SECONDS = int(os.environ.get("LOOKUP_TTL_SECONDS", 24 * 60 * 60))
+LOOKUP_SNAPSHOT_PATH = os.environ.get(
+    "LOOKUP_SNAPSHOT_PATH", os.path.join(gettempdir(), "tos_hub_lookup_snapshot.sqlite")
+)
+LOOKUP_DB_PATH = os.environ.get("LOOKUP_DB_PATH", os.path.join(gettempdir(), "tos_hub_lookups.sqlite"))
+SUPABASE_QUERY_CHUNK = 500
+SQLITE_QUERY_CHUNK = 900  # below SQLite's default limit of 999 bound variables
+
+# lookup name -> (table, key column, value column); the same names are used
+# by Supabase and the local stand-in
+LOOKUP_TABLES = {
+    "sku_upc": ("sku_upc", "sku", "upc"),
+    "fnsku_product_name": ("fnsku_product_names", "fnsku", "product_name"),
+}
+
+# label kind -> (lookup, upload key column, upload column it fills)
+LABEL_LOOKUPS = {
+    "d2c": ("sku_upc", 'SKU', 'UPC Code'),
+    "fnsku": ("fnsku_product_name", 'FNSKU', 'Product Name'),
+}
+
+# Admin bulk updates use the README's upload columns
+BULK_UPDATE_COLUMNS = {
+    "sku_upc": ('SKU', 'UPC'),
+    "fnsku_product_name": ('FNSKU', 'Product Name'),
+}
+
+@contextmanager
+def _sqlite(path):
+    # A connection per use: cheap for SQLite and safe across job threads.
+    # Commits on success, rolls back on error, always closes.
+    db = sqlite3.connect(path, timeout=30)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+def normalize_key(lookup, value):
+    key = str(value).strip()
+    return key.upper() if lookup == "fnsku_product_name" else key
+
+# --- BACKENDS ---
+# fetch(lookup, keys) -> {key: value} for the keys that exist;
+# upsert(lookup, pairs) writes (key, value) pairs.
+
+class SqliteLookupBackend:
+    """Local stand-in for the Supabase tables."""
+
+    def __init__(self, path):
+        self.path = path
+        with _sqlite(self.path) as db:
+            for table, key, value in LOOKUP_TABLES.values():
+                db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key} TEXT PRIMARY KEY, {value} TEXT)")
+
+    def fetch(self, lookup, keys):
+        table, key, value = LOOKUP_TABLES[lookup]
+        found = {}
+        with _sqlite(self.path) as db:
+            for chunk in chunked(keys, SQLITE_QUERY_CHUNK):
+                placeholders = ",".join("?" * len(chunk))
+                found.update(db.execute(f"SELECT {key}, {value} FROM {table} WHERE {key} IN ({placeholders})", chunk))
+        return found
+
+    def upsert(self, lookup, pairs):
+        table, key, value = LOOKUP_TABLES[lookup]
+        with _sqlite(self.path) as db:
+            db.executemany(
+                f"INSERT INTO {table} ({key}, {value}) VALUES (?, ?) "
+                f"ON CONFLICT({key}) DO UPDATE SET {value} = excluded.{value}",
+                pairs,
+            )
+
+class SupabaseLookupBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def fetch(self, lookup, keys):
+        table, key, value = LOOKUP_TABLES[lookup]
+        found = {}
+        for chunk in chunked(keys, SUPABASE_QUERY_CHUNK):
+            response = self.client.table(table).select(f"{key},{value}").in_(key, chunk).execute()
+            found.update((row[key], row[value]) for row in response.data)
+        return found
+
+    def upsert(self, lookup, pairs):
+        table, key, value = LOOKUP_TABLES[lookup]
+        records = [{key: k, value: v} for k, v in pairs]
+        for chunk in chunked(records, SUPABASE_QUERY_CHUNK):
+            self.client.table(table).upsert(chunk, on_conflict=key).execute()
+
+def uses_supabase(config):
+    return bool(config.get("url") and config.get("key"))
+
+def lookups_configured(config):
+    """True when a real database was set up: Supabase, or an explicit LOOKUP_DB_PATH."""
+    return uses_supabase(config) or "LOOKUP_DB_PATH" in os.environ
+
+def lookup_backend_label(config):
+    return "Supabase" if uses_supabase(config) else f"local SQLite stand-in ({LOOKUP_DB_PATH})"
+
+def lookup_backend(config):
+    """Supabase if config has "url" and "key", otherwise the local SQLite stand-in."""
+    if uses_supabase(config):
+        from supabase import create_client
+        return SupabaseLookupBackend(create_client(config["url"], config["key"]))
+    return SqliteLookupBackend(LOOKUP_DB_PATH)
+
+class LazyLookupBackend:
+    """Builds the configured backend on the first fetch or upsert."""
+
+    def __init__(self, config):
+        self.config = config
+        self.label = lookup_backend_label(config)
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if self._backend is None:
+                self._backend = lookup_backend(self.config)
+            return self._backend
+
+    def fetch(self, lookup, keys):
+        return self._get().fetch(lookup, keys)
+
+    def upsert(self, lookup, pairs):
+        self._get().upsert(lookup, pairs)
+
+# --- READ-THROUGH CACHE ---
+# Entries are (value, fetched_at); value None records a key the database
+# does not have, so unknown SKUs don't cost a query on every upload.
+
+class LookupCache:
+    def __init__(self, maxsize=LOOKUP_CACHE_SIZE, ttl_seconds=LOOKUP_TTL_SECONDS, snapshot_path=LOOKUP_SNAPSHOT_PATH):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = snapshot_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._snapshot_ok = None  # created on first use
+
+    def _snapshot_ready(self):
+        if self._snapshot_ok is None:
+            self._snapshot_ok = self._init_snapshot()
+        return self._snapshot_ok
+
+    def _init_snapshot(self):
+        if not self.snapshot_path:
+            return False
+        try:
+            with _sqlite(self.snapshot_path) as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS entries (lookup TEXT, key TEXT, value TEXT, fetched_at REAL, "
+                    "PRIMARY KEY (lookup, key))"
+                )
+            return True
+        except sqlite3.Error:
+            return False  # the snapshot is best effort; the memory cache still works
+
+    def get_many(self, lookup, keys):
+        """Returns ({key: value} for fresh entries, keys still to fetch, snapshot hits)."""
+        cutoff = time.time() - self.ttl_seconds
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get((lookup, key))
+                if entry is not None and entry[1] >= cutoff:
+                    self._entries.move_to_end((lookup, key))
+                    found[key] = entry[0]
+                else:
+                    missing.append(key)
+        if not missing or not self._snapshot_ready():
+            return found, missing, 0
+        snapshot = {}
+        try:
+            with _sqlite(self.snapshot_path) as db:
+                for chunk in chunked(missing, SQLITE_QUERY_CHUNK):
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = db.execute(
+                        f"SELECT key, value, fetched_at FROM entries WHERE lookup = ? AND key IN ({placeholders}) "
+                        "AND fetched_at >= ?",
+                        [lookup, *chunk, cutoff],
+                    )
+                    snapshot.update((key, (value, fetched_at)) for key, value, fetched_at in rows)
+        except sqlite3.Error:
+            pass
+        self._remember(lookup, snapshot)
+        found.update((key, entry[0]) for key, entry in snapshot.items())
+        return found, [key for key in missing if key not in snapshot], len(snapshot)
+
+    def put_many(self, lookup, values):
+        """values: {key: value or None}."""
+        fetched_at = time.time()
+        entries = {key: (value, fetched_at) for key, value in values.items()}
+        self._remember(lookup, entries)
+        if not entries or not self._snapshot_ready():
+            return
+        try:
+            with _sqlite(self.snapshot_path) as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO entries (lookup, key, value, fetched_at) VALUES (?, ?, ?, ?)",
+                    [(lookup, key, value, fetched_at) for key, (value, fetched_at) in entries.items()],
+                )
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, lookup, entries):
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[(lookup, key)] = entry
+                self._entries.move_to_end((lookup, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, lookup=None, keys=None):
+        """Drop keys of one lookup, a whole lookup, or (no arguments) everything."""
+        with self._lock:
+            if keys is not None:
+                for key in keys:
+                    self._entries.pop((lookup, key), None)
+            else:
+                for entry_key in [k for k in self._entries if lookup is None or k[0] == lookup]:
+                    del self._entries[entry_key]
+        if not self._snapshot_ready():
+            return
+        try:
+            with _sqlite(self.snapshot_path) as db:
+                if keys is not None:
+                    db.executemany("DELETE FROM entries WHERE lookup = ? AND key = ?", [(lookup, key) for key in keys])
+                elif lookup is not None:
+                    db.execute("DELETE FROM entries WHERE lookup = ?", (lookup,))
+                else:
+                    db.execute("DELETE FROM entries")
+        except sqlite3.Error:
+            pass
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+# --- SERVICE ---
+
+class LookupService:
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache if cache is not None else LookupCache()
+
+    def resolve(self, lookup, keys, stats=None):
+        """
+        {key: value} for the keys the database knows, with at most one bulk
+        backend fetch. stats (a dict of counters) receives lookup_memory_hits,
+        lookup_snapshot_hits and lookup_fetched.
+        """
+        keys = list(dict.fromkeys(keys))
+        with stage("lookup.cache"):
+            found, missing, snapshot_hits = self.cache.get_many(lookup, keys)
+        if missing:
+            with stage("lookup.fetch"):
+                fetched = self.backend.fetch(lookup, missing)
+            self.cache.put_many(lookup, {key: fetched.get(key) for key in missing})
+            found.update(fetched)
+        if stats is not None:
+            stats["lookup_memory_hits"] += len(keys) - len(missing) - snapshot_hits
+            stats["lookup_snapshot_hits"] += snapshot_hits
+            stats["lookup_fetched"] += len(missing)
+        return {key: value for key, value in found.items() if value is not None}
+
+    def bulk_update(self, lookup, pairs):
+        """Upsert (key, value) pairs and invalidate exactly those keys in the cache."""
+        pairs = [(normalize_key(lookup, key), str(value).strip()) for key, value in pairs]
+        self.backend.upsert(lookup, pairs)
+        self.cache.invalidate(lookup, [key for key, _ in pairs])
+        return len(pairs)
+
+    def invalidate(self, lookup=None):
+        self.cache.invalidate(lookup)
+
+def bulk_update_pairs(lookup, df):
+    """(key, value) pairs from an admin upload. Raises ValueError on missing columns."""
+    key_column, value_column = BULK_UPDATE_COLUMNS[lookup]
+    missing = [column for column in (key_column, value_column) if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing columns in the uploaded file: {', '.join(missing)}")
+    keys = df[key_column].astype("string").str.strip()
+    values = df[value_column].astype("string").str.strip()
+    present = keys.fillna("").ne("") & values.fillna("").ne("")
+    return list(zip(keys[present].tolist(), values[present].tolist()))
+
+def fill_label_fields(kind, df, service, stats=None):
+    """
+    Return (df, filled, unresolved): a copy of the upload with blank (or
+    absent) UPC Code / Product Name cells filled from the lookup, resolved
+    for the whole batch in one go. Rows that stay blank are left for
+    validation to report.
+    """
+    lookup, key_column, value_column = LABEL_LOOKUPS[kind]
+    if key_column not in df.columns:
+        return df, 0, 0
+    df = df.copy()
+    if value_column not in df.columns:
+        df[value_column] = pd.Series(pd.NA, index=df.index, dtype="string")
+    keys = df[key_column].astype("string").str.strip()
+    if lookup == "fnsku_product_name":
+        keys = keys.str.upper()
+    blank = df[value_column].astype("string").str.strip().fillna("").eq("") & keys.fillna("").ne("")
+    if not blank.any():
+        return df, 0, 0
+    values = service.resolve(lookup, keys[blank].tolist(), stats)
+    resolved = keys[blank].map(values)
+    df[value_column] = df[value_column].astype("string")
+    df.loc[resolved.index, value_column] = resolved.astype("string")
+    filled = int(resolved.notna().sum())
+    return df, filled, int(blank.sum()) - filled
+
+@process_singleton
+def get_lookup_service(config=None):
+    # The first caller's config picks the backend
+    return LookupService(LazyLookupBackend(config or {}))
@@ -0,0 +1,359 @@
+"""
+Packing List (PL) building for the TOs Hub PL Builder.
+
+Kept free of Streamlit so it can be driven headlessly (benchmarks, scripts).
+"""
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from ingest import read_table
+from instrumentation import Instrumentation, current, recording, stage
+from shared import unique_name
+
+# Optional: clean up inconsistent location names for standardization
+LOCATION_MAP = {
+    "JD NJ : JD NJ - AMZ FBA": "JD NJ - AMZ FBA",
+    "JD Canada : JD Canada - AMZ FBA": "JD CANADA - AMZ FBA",
+    "JD UK : JD UK - AMZ FBA": "JD UK - AMZ FBA",
+    "JD AU : JD AU - AMZ FBA": "JD AU - AMZ FBA",
+    "AMAZON FBA CA": "AMAZON FBA CANADA",
+    "Amazon FBA UK": "AMAZON FBA UK",
+    "JD - Belk": "JD CA - BELK",
+    "JD - Showcase": "JD CANADA - SHOWCASE",
+    "JD Canada": "JD CANADA",
+    "JD CA - Walmart": "JD CA - WALMART",
+    "JD - Nordstrom.com": "JD CA - NORDSTROM.COM",
+    "JD - Nordstrom Stores": "JD CA - NORDSTROM STORES",
+    "JD CA - Macy's": "JD CA - MACY'S",
+    "JD NJ - Macy's": "JD CA - MACY'S",
+    "JD ATL - Macy's": "JD CA - MACY'S",
+    "Kenz - SALASA": "SALAZA SA - KENZ",
+    "Kenz - SALASA": "SALAZA SA",
+    "JD Canada - Walmart": "JD CANADA - WALMART",
+    "Lateral TJ": "LATERAL TJ"
+    
+
+
+    
+    # You can keep expanding this list as needed
+}
+
+PL_FORM_URL = "https://docs.google.com/forms/d/e/1FAIpQLSelQ08zk5O1py2t5czsuW4jnpVYO22LAtMskBxlbk__WuRgmA/viewform"
+PL_REQUIRED_COLUMNS = [
+    'TO', 'FOP SO #', 'From Loc', 'To Loc',
+    'SKU External ID', 'Required Qty', 'Shipping Method'
+]
+# Everything else in an export is never parsed
+PL_UPLOAD_COLUMNS = PL_REQUIRED_COLUMNS + ['Total QTY', 'Trafilea SKU']
+PL_TEXT_COLUMNS = ['TO', 'FOP SO #', 'SKU External ID', 'Destination SKU', 'Trafilea SKU']
+PL_BUILD_WORKERS = min(8, os.cpu_count() or 1)
+
+def read_pl_upload(name, data):
+    """Parse an uploaded PL export (CSV or Excel bytes) with stripped column names."""
+    return read_table(
+        name, data, columns=PL_UPLOAD_COLUMNS, text_columns=PL_TEXT_COLUMNS,
+        match=lambda column: "destination sku" in column.lower()
+    )
+
+def is_transformation(df):
+    return any("destination sku" in col.lower() for col in df.columns)
+
+def _require_pl_columns(df, transformation=False):
+    required_cols = PL_REQUIRED_COLUMNS + (['Destination SKU'] if transformation else [])
+    missing = [col for col in required_cols if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+def _is_total(column):
+    return column.astype(str).str.strip().str.lower().eq('total')
+
+def summarize_pl(df):
+    """
+    Everything the filename and the form prefill need, from one pass over the
+    export: header values from the first row, units and SKU count over the
+    item rows (the 'Total' row excluded) and the declared 'Total QTY'.
+    """
+    is_total = _is_total(df['TO'])
+    items = df[~is_total]
+    qty = int(pd.to_numeric(items['Required Qty'], errors='coerce').sum())
+
+    # Prefer 'Total QTY' from the 'Total' row; fall back to the summed units
+    total_qty = qty
+    if 'Total QTY' in df.columns:
+        total_rows = is_total
+        if not total_rows.any() and 'Trafilea SKU' in df.columns:
+            total_rows = _is_total(df['Trafilea SKU'])
+        if total_rows.any():
+            qty_val = df.loc[total_rows, 'Total QTY'].iloc[0]
+            if pd.notna(qty_val) and float(qty_val) > 0:
+                total_qty = int(float(qty_val))
+
+    first = df.iloc[0]
+    return {
+        "to": first['TO'],
+        "so": first['FOP SO #'],
+        "from_loc": first['From Loc'],
+        "to_loc": first['To Loc'],
+        "shipping_method": first['Shipping Method'],
+        "qty": qty,
+        "total_qty": total_qty,
+        "sku_count": items['SKU External ID'].nunique(),
+    }
+
+def pl_filename(summary):
+    return f"{summary['to']} + {summary['so']} + {summary['from_loc']} + {summary['to_loc']} + {summary['total_qty']} Units.xlsx"
+
+def normalize_location(value):
+    value = str(value).strip()
+    return LOCATION_MAP.get(value, value)
+
+def pl_form_link(summary):
+    """Prefilled TO Template form link for a summarize_pl() result."""
+    def enc(val): return urllib.parse.quote_plus(str(val))
+    return (
+        PL_FORM_URL +
+        f"?entry.811040286={enc(summary['to'])}"
+        f"&entry.771037158={enc(summary['so'])}"
+        f"&entry.75050938={summary['qty']}"
+        f"&entry.2087058692={summary['sku_count']}"
+        f"&entry.227202689={enc(normalize_location(summary['from_loc']))}"
+        f"&entry.855389021={enc(normalize_location(summary['to_loc']))}"
+        f"&entry.105986750={enc(summary['shipping_method'])}"
+    )
+
+PL_HEADERS = [
+    "TO", "SO #", "From Loc", "To Loc", "Trafilea SKU", "Required Qty",
+    "Shipping Method", "FG", "LOT", "Expiration Date", "CARTONS",
+    "UNITS/Ctn", "Total QTY", "Carton Dimensions(inch) ", "Carton WEIGHT-LB",
+    "Pallet Dimensions", "Pallet WEIGHT-LB.", "Pallet #"
+]
+PL_KEY_HEADERS = [
+    "TO", "SO #", "From Loc", "To Loc", "Trafilea SKU", "Destination SKU", "Required Qty", "Shipping Method"
+]
+
+def _pl_output_frame(df, transformation):
+    # === OUTPUT COLUMNS ===
+    headers = list(PL_HEADERS)
+    if transformation:
+        headers.insert(5, "Destination SKU")
+
+    output_df = pd.DataFrame(columns=headers)
+    output_df['TO'] = df['TO']
+    output_df['SO #'] = df['FOP SO #']
+    output_df['From Loc'] = df['From Loc']
+    output_df['To Loc'] = df['To Loc']
+    output_df['Trafilea SKU'] = df['SKU External ID']
+    output_df['Required Qty'] = df['Required Qty']
+    output_df['Shipping Method'] = df['Shipping Method']
+
+    if transformation and 'Destination SKU' in df.columns:
+        output_df['Destination SKU'] = df['Destination SKU']
+    if 'Total QTY' in df.columns:
+        output_df['Total QTY'] = df['Total QTY']
+    return output_df
+
+def _write_pl_workbook(output_df):
+    # === EXCEL EXPORT ===
+    # constant_memory flushes each row as soon as the next one starts, so RAM
+    # stays flat however long the PL is. It requires strictly row-by-row
+    # writes, hence xlsxwriter directly instead of DataFrame.to_excel (which
+    # writes column by column).
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('PL')
+
+    dark_blue = workbook.add_format({
+        'bold': True, 'bg_color': '#0C2D63', 'font_color': 'white',
+        'border': 1, 'align': 'center', 'valign': 'vcenter'
+    })
+    light_blue = workbook.add_format({
+        'bold': True, 'bg_color': '#D9EAF7', 'border': 1,
+        'align': 'center', 'valign': 'vcenter'
+    })
+
+    for col_num, col_name in enumerate(output_df.columns):
+        header_format = dark_blue if col_name in PL_KEY_HEADERS else light_blue
+        worksheet.write(0, col_num, col_name, header_format)
+        worksheet.set_column(col_num, col_num, 22)
+
+    values = output_df.astype(object).where(output_df.notna(), None)
+    for row_num, row in enumerate(values.itertuples(index=False, name=None), start=1):
+        for col_num, value in enumerate(row):
+            if value is not None:
+                worksheet.write(row_num, col_num, value.item() if hasattr(value, "item") else value)
+    workbook.close()
+    output.seek(0)
+    return output
+
+def build_pl_base(df, transformation=False, summary=None):
+    _require_pl_columns(df, transformation)
+
+    # === FILE NAMING LOGIC ===
+    if summary is None:
+        with stage("pl_summary"):
+            summary = summarize_pl(df)
+    filename = pl_filename(summary)
+
+    with stage("pl_build_frame"):
+        output_df = _pl_output_frame(df, transformation)
+    with stage("pl_excel_write", sample=True):
+        output = _write_pl_workbook(output_df)
+    return output, filename
+
+# --- CONSOLIDATED EXPORTS ---
+# An ERP export can carry many TOs in one sheet. split_pl_export() normalizes
+# the (TO, FOP SO #) keys once (stripped text, blank for NaN) and walks a
+# single groupby: each group's summary is computed from the same rows its PL
+# is written from. A blank SO is a group of its own; rows with a blank TO
+# can't be assigned and are reported by unassigned_pl_rows(). Grand 'Total'
+# rows (TO == 'Total') belong to no group and are dropped; per-group total
+# rows (Trafilea SKU == 'Total') stay with their group and their 'Total QTY'
+# names the file, as in the single-TO case.
+PL_GROUP_COLUMNS = ['TO', 'FOP SO #']
+
+def _pl_group_keys(df):
+    return pd.DataFrame({
+        column: df[column].astype("string").str.strip().fillna("") for column in PL_GROUP_COLUMNS
+    }, index=df.index)
+
+def _group_total_rows(df):
+    if 'Trafilea SKU' not in df.columns:
+        return pd.Series(False, index=df.index)
+    return _is_total(df['Trafilea SKU'])
+
+def summarize_pl_group(to, so, group):
+    """summarize_pl() for one group of a split export; None if it has no item rows."""
+    total_rows = _group_total_rows(group)
+    items = group[~total_rows]
+    if items.empty:
+        return None
+    qty = int(pd.to_numeric(items['Required Qty'], errors='coerce').sum())
+    total_qty = qty
+    if 'Total QTY' in group.columns and total_rows.any():
+        declared = pd.to_numeric(group.loc[total_rows, 'Total QTY'], errors='coerce').iloc[0]
+        if declared > 0:
+            total_qty = int(declared)
+    # First non-blank value of each header column
+    header = items[['From Loc', 'To Loc', 'Shipping Method']].bfill().iloc[0]
+    return {
+        "to": to,
+        "so": so,
+        "from_loc": header['From Loc'],
+        "to_loc": header['To Loc'],
+        "shipping_method": header['Shipping Method'],
+        "qty": qty,
+        "total_qty": total_qty,
+        "sku_count": items['SKU External ID'].nunique(),
+    }
+
+def unassigned_pl_rows(df):
+    """Excel row numbers of item rows a split can't put in any PL (blank TO)."""
+    item_rows = ~_is_total(df['TO']) & ~_group_total_rows(df)
+    blank_to = _pl_group_keys(df)['TO'].eq("")
+    return (np.flatnonzero(item_rows & blank_to) + 2).tolist()
+
+def split_pl_export(df, transformation=False):
+    """
+    One PL per (TO, FOP SO #) group of a consolidated export. Yields
+    (summary, output, filename) in order of first appearance; rows with a
+    blank TO are skipped (see unassigned_pl_rows).
+    """
+    _require_pl_columns(df, transformation)
+    body = df[~_is_total(df['TO'])]
+    keys = _pl_group_keys(body)
+    assigned = keys['TO'].ne("")
+    body, keys = body[assigned], keys[assigned]
+    for (to, so), group in body.groupby([keys['TO'], keys['FOP SO #']], sort=False):
+        with stage("pl_summary"):
+            summary = summarize_pl_group(to, so, group)
+        if summary is None:
+            continue  # only per-group total rows, no items
+        with stage("pl_build_frame"):
+            output_df = _pl_output_frame(group, transformation)
+        with stage("pl_excel_write", sample=True):
+            output = _write_pl_workbook(output_df)
+        yield summary, output, pl_filename(summary)
+
+# --- MULTI-FILE BUILDS ---
+# Each upload is parsed, summarized and written exactly once, on a small
+# thread pool; results come back in upload order. A file that fails is kept
+# as an entry with an "error" so the rest of the upload still goes through.
+# With split=True every upload is treated as a consolidated export and yields
+# one entry per TO.
+
+def build_pl_file(name, data, split=False):
+    """
+    Returns a list of {"name", "filename", "data", "form_link"} entries, or
+    a single {"name", "error"} entry if the file could not be built. A split
+    export also gets an error entry for rows that belong to no TO.
+    """
+    try:
+        with stage("read_upload", sample=True):
+            df = read_pl_upload(name, data)
+        transformation = is_transformation(df)
+        if split:
+            entries = [
+                {"name": name, "filename": filename, "data": output.getvalue(), "form_link": pl_form_link(summary)}
+                for summary, output, filename in split_pl_export(df, transformation)
+            ]
+            unassigned = unassigned_pl_rows(df)
+            if unassigned:
+                rows = ", ".join(str(row) for row in unassigned[:10]) + (", ..." if len(unassigned) > 10 else "")
+                entries.append({
+                    "name": name, "error": f"{len(unassigned)} row(s) have no TO and are in no PL (rows {rows})"
+                })
+            elif not entries:
+                entries.append({"name": name, "error": "No TO rows to build a PL from"})
+            return entries
+        _require_pl_columns(df, transformation)
+        with stage("pl_summary"):
+            summary = summarize_pl(df)
+        output, filename = build_pl_base(df, transformation=transformation, summary=summary)
+    except Exception as e:
+        return [{"name": name, "error": str(e)}]
+    return [{"name": name, "filename": filename, "data": output.getvalue(), "form_link": pl_form_link(summary)}]
+
+def _build_pl_file_recorded(name, data, split):
+    # Stage timings are per thread; ship them back as stats for the caller
+    with recording(Instrumentation()) as run:
+        entries = build_pl_file(name, data, split)
+    return entries, run.to_stats()
+
+def build_pl_files(uploads, progress_callback=None, workers=PL_BUILD_WORKERS, split=False):
+    """Build the PLs for (name, bytes) uploads. Returns entries in upload order."""
+    run = current()
+    results = [None] * len(uploads)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(uploads))), thread_name_prefix="pl-build")
+    try:
+        futures = {
+            executor.submit(_build_pl_file_recorded, name, data, split): i
+            for i, (name, data) in enumerate(uploads)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_entries, stats = future.result()
+            results[futures[future]] = file_entries
+            if run is not None:
+                run.merge_stats(stats)
+            if progress_callback:
+                progress_callback(done / len(uploads))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [entry for file_entries in results for entry in file_entries]
+
+def zip_pl_files(entries):
+    """One ZIP with every successfully built PL; duplicate filenames get a suffix."""
+    output = BytesIO()
+    seen = set()
+    with ZipFile(output, 'w') as zip_file:
+        for entry in entries:
+            if "data" not in entry:
+                continue
+            zip_file.writestr(unique_name(entry["filename"], seen), entry["data"])
+    return output.getvalue()
@@ -0,0 +1,38 @@
+"""
+Small helpers shared by the label, PL, lookup and job modules.
+"""
+import functools
+import os
+import threading
+
+def chunked(items, size):
+    """items as consecutive slices of at most size."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def unique_name(filename, seen):
+    """filename, or "name_2.ext", "name_3.ext"... if taken; the result is added to seen."""
+    base, ext = os.path.splitext(filename)
+    candidate, n = filename, 2
+    while candidate in seen:
+        candidate = f"{base}_{n}{ext}"
+        n += 1
+    seen.add(candidate)
+    return candidate
+
+def process_singleton(factory):
+    """
+    Decorator: the first call builds the object, every later call returns
+    that same object (arguments of later calls are ignored). It lives at
+    module level, so it outlives Streamlit reruns (the script is re-executed,
+    imported modules are not) and is shared across sessions and job threads.
+    """
+    instance = []
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get(*args, **kwargs):
+        with lock:
+            if not instance:
+                instance.append(factory(*args, **kwargs))
+            return instance[0]
+    return get
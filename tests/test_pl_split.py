@@ -0,0 +1,72 @@
+"""
+Splitting consolidated ERP exports into one PL per (TO, FOP SO #): blank
+keys, per-group 'Total' rows and the grand 'Total' row.
+"""
+import os
+import sys
+from io import BytesIO
+
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from pl_builder import build_pl_file  # noqa: E402
+
+HEADER = "TO,FOP SO #,From Loc,To Loc,SKU External ID,Trafilea SKU,Required Qty,Total QTY,Shipping Method"
+
+def export_csv(*rows):
+    return "\n".join((HEADER,) + rows).encode("utf-8")
+
+def built(entries):
+    return [entry for entry in entries if "data" in entry]
+
+def errors(entries):
+    return [entry["error"] for entry in entries if "error" in entry]
+
+def pl_rows(entry):
+    return pd.read_excel(BytesIO(entry["data"]), dtype=str)
+
+def test_split_keeps_blank_so_and_uses_group_totals():
+    entries = build_pl_file("export.csv", export_csv(
+        "TO1,SO1,WH1,WH2,SKU-A,SKU-A,5,,Ground",
+        "TO1,SO1,WH1,WH2,SKU-B,SKU-B,7,,Ground",
+        "TO1,SO1,,,,Total,,12,",
+        "TO2,,WH1,WH3,SKU-C,SKU-C,3,,Air",
+        "Total,,,,,,,15,",
+    ), split=True)
+    assert errors(entries) == []
+    to1, to2 = built(entries)
+
+    assert to1["filename"] == "TO1 + SO1 + WH1 + WH2 + 12 Units.xlsx"
+    assert "entry.75050938=12" in to1["form_link"] and "entry.2087058692=2" in to1["form_link"]
+    # The per-group total row stays in its PL, the grand total is in none
+    assert pl_rows(to1)["Total QTY"].fillna("").tolist() == ["", "", "12"]
+
+    # A blank FOP SO # is a group of its own, not a dropped one
+    assert to2["filename"] == "TO2 +  + WH1 + WH3 + 3 Units.xlsx"
+    assert "entry.75050938=3" in to2["form_link"]
+    assert pl_rows(to2)["Trafilea SKU"].tolist() == ["SKU-C"]
+    assert pl_rows(to2)["Total QTY"].isna().all()
+
+def test_split_without_any_so_builds_every_to():
+    entries = build_pl_file("export.csv", export_csv(
+        "TO1,,WH1,WH2,SKU-A,SKU-A,5,,Ground",
+        "TO2,,WH1,WH3,SKU-B,SKU-B,4,,Ground",
+    ), split=True)
+    assert [entry["filename"] for entry in built(entries)] == [
+        "TO1 +  + WH1 + WH2 + 5 Units.xlsx", "TO2 +  + WH1 + WH3 + 4 Units.xlsx"
+    ]
+
+def test_split_reports_rows_without_a_to():
+    entries = build_pl_file("export.csv", export_csv(
+        "TO1,SO1,WH1,WH2,SKU-A,SKU-A,5,,Ground",
+        ",SO2,WH1,WH2,SKU-B,SKU-B,4,,Ground",
+        " ,SO2,WH1,WH2,SKU-C,SKU-C,1,,Ground",
+    ), split=True)
+    assert [entry["filename"] for entry in built(entries)] == ["TO1 + SO1 + WH1 + WH2 + 5 Units.xlsx"]
+    assert errors(entries) == ["2 row(s) have no TO and are in no PL (rows 3, 4)"]
+
+def test_split_with_nothing_to_build_is_an_error():
+    entries = build_pl_file("export.csv", export_csv("Total,,,,,,,0,"), split=True)
+    assert errors(entries) == ["No TO rows to build a PL from"]
@@ -0,0 +1,57 @@
+"""
+UPC normalization and validation in prepare_d2c_rows: what Excel and CSV
+exports do to UPC cells, and which of those can be turned back into digits.
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from labels_core import prepare_d2c_rows  # noqa: E402
+
+LOST_DIGITS = "UPC Code was stored in scientific notation and lost digits"
+
+def prepare_upc(upc):
+    """(normalized UPC, None) for a valid cell, (None, error message) otherwise."""
+    df = pd.DataFrame({"SKU": ["SKU-1"], "UPC Code": pd.Series([upc], dtype="string"), "LOT#": [""]})
+    rows, invalid_rows = prepare_d2c_rows(df)
+    if rows:
+        (_, _, (_, normalized, _), _), = rows
+        return normalized, None
+    (_, message), = invalid_rows
+    return None, message
+
+@pytest.mark.parametrize("upc, expected", [
+    ("12345678905", "0012345678905"),           # 11 digits: UPC-A with its leading zero dropped
+    ("012345678905", "0012345678905"),          # 12-digit UPC-A
+    ("4006381333931", "4006381333931"),         # 13-digit EAN
+    ("12345678905.0", "0012345678905"),         # Excel float rendering
+    ("1.23456789012E+11", "0123456789012"),     # scientific, every digit still there
+    ("4.006381333931e+12", "4006381333931"),
+])
+def test_valid_upcs_are_normalized(upc, expected):
+    assert prepare_upc(upc) == (expected, None)
+
+@pytest.mark.parametrize("upc", [
+    "1.23457E+11",   # 123457000000: truncated, yet its check digit happens to be valid
+    "1.23456E+11",   # truncated with an invalid check digit
+    "4.00638E+12",
+])
+def test_truncated_scientific_upcs_are_rejected(upc):
+    assert prepare_upc(upc) == (None, LOST_DIGITS)
+
+@pytest.mark.parametrize("upc", ["012345678906", "4006381333932", "1.23456789013E+11"])
+def test_bad_check_digit_is_rejected(upc):
+    assert prepare_upc(upc) == (None, "Invalid UPC/EAN check digit")
+
+@pytest.mark.parametrize("upc, message", [
+    ("", "Missing UPC Code"),
+    ("12345678901234", "UPC Code must be up to 13 digits"),
+    ("ABC", "UPC Code must be up to 13 digits"),
+])
+def test_malformed_upcs_are_rejected(upc, message):
+    assert prepare_upc(upc) == (None, message)
@@ -0,0 +1,105 @@
+"""
+Golden-file tests for the ZPL output: the jobs in tests/golden are what the
+printer receives, checked byte for byte, for single labels (label_zpl) and
+for multi-row batches (generate_labels). After an intended change to the
+ZPL layouts, review the diff and regenerate them with
+
+    python tests/test_zpl.py --update
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+GOLDEN_DIR = os.path.join(REPO_ROOT, "tests", "golden")
+
+import labels_core  # noqa: E402
+from labels_core import generate_labels, label_zpl  # noqa: E402
+
+DOTS_PER_MM = 8
+
+# golden name -> (layout, args in the layout's field order, copies)
+SINGLE_LABELS = {
+    "d2c_60x35_lot": ("d2c_60x35", ("SKU-1001", "0012345678905", "LOT-2407"), 1),
+    "d2c_60x35_no_lot": ("d2c_60x35", ("SKU-1002", "4006381333931", ""), 1),
+    "d2c_60x35_copies": ("d2c_60x35", ("SKU-1003", "0012345678905", "L7"), 5),
+    "d2c_60x35_escapes": ("d2c_60x35", ("A_B^C~D", "0012345678905", "L_1^2~3"), 1),
+    "fnsku_60x35_lot": ("fnsku_60x35", ("X00ABCDEFG", "Seamless Shaping Bodysuit", "LOT-2407"), 1),
+    "fnsku_60x35_no_lot": ("fnsku_60x35", ("X00ABCDEFH", "Bra", ""), 1),
+    "fnsku_60x35_copies": ("fnsku_60x35", ("X00ABCDEFJ", "Sculpting Thong", "L7"), 3),
+    # Two wrapped lines joined by \&, truncated with "...", with _ ^ ~ escaped
+    "fnsku_60x35_wrapped_escapes": (
+        "fnsku_60x35", ("X00ABCDEFK", "Back\\slash ^Black^ ~Large Bodysuit, extra long_name_here", "L_1"), 1
+    ),
+}
+
+# golden name -> (kind, upload); covers lot/no-lot rows, Quantity copies and escaping
+BATCHES = {
+    "d2c_60x35_batch": ("d2c", pd.DataFrame({
+        "SKU": ["SKU-1001", "SKU-1002", "A_B^C~D", "SKU-1003"],
+        "UPC Code": ["012345678905", "4006381333931", "012345678905", "012345678905"],
+        "LOT#": ["LOT-2407", None, "L_1^2~3", "L7"],
+        "Quantity": [1, 1, 1, 5],
+    })),
+    "fnsku_60x35_batch": ("fnsku", pd.DataFrame({
+        "FNSKU": ["X00ABCDEFG", "X00ABCDEFH", "X00ABCDEFJ", "X00ABCDEFK"],
+        "Product Name": [
+            "Seamless Shaping Bodysuit", "Bra", "Sculpting Thong",
+            "Back\\slash ^Black^ ~Large Bodysuit, extra long_name_here",
+        ],
+        "LOT#": ["LOT-2407", None, "L7", "L_1"],
+        "Quantity": [1, 1, 3, 1],
+    })),
+}
+
+def golden_path(name):
+    return os.path.join(GOLDEN_DIR, f"{name}.zpl")
+
+def read_golden(name):
+    with open(golden_path(name), "rb") as f:
+        return f.read()
+
+def render_single(name):
+    layout, args, copies = SINGLE_LABELS[name]
+    return label_zpl(layout, args, copies=copies, dots_per_mm=DOTS_PER_MM).encode("utf-8")
+
+def render_batch(name):
+    kind, df = BATCHES[name]
+    output, _, row_errors, _ = generate_labels(kind, df, "zpl", use_cache=False)
+    assert row_errors == []
+    with output:
+        return output.read()
+
+@pytest.mark.parametrize("name", sorted(SINGLE_LABELS))
+def test_single_label_matches_golden(name):
+    assert render_single(name) == read_golden(name)
+
+# generate_labels renders at the module default resolution
+@pytest.mark.skipif(labels_core.ZPL_DOTS_PER_MM != DOTS_PER_MM, reason="ZPL_DOTS_PER_MM is overridden")
+@pytest.mark.parametrize("name", sorted(BATCHES))
+def test_batch_matches_golden(name):
+    assert render_batch(name) == read_golden(name)
+
+def test_escaped_characters_never_reach_the_printer_raw():
+    label = render_single("fnsku_60x35_wrapped_escapes").split(b"^XA^XF", 1)[1]
+    field_data = b"".join(part.split(b"^FS")[0] for part in label.split(b"^FD")[1:])
+    assert b"~" not in field_data and b"^" not in field_data
+    assert b"_5F" in field_data and b"_5E" in field_data and b"_7E" in field_data
+    assert b"\\&" in field_data and b"\\\\" in field_data
+
+def update_goldens():
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name in SINGLE_LABELS:
+        with open(golden_path(name), "wb") as f:
+            f.write(render_single(name))
+    for name in BATCHES:
+        with open(golden_path(name), "wb") as f:
+            f.write(render_batch(name))
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--update"]:
+        sys.exit(f"usage: python {sys.argv[0]} --update")
+    update_goldens()